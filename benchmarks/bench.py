@@ -0,0 +1,344 @@
+# -*- coding:utf-8 -*-
+"""
+pytest-apistellar性能基准测试
+
+    python benchmarks/bench.py                # 运行并与基线对比
+    python benchmarks/bench.py --save         # 运行并保存为基线
+    python benchmarks/bench.py --modules 50 --marks 10 --depth 6
+
+微基准测试统计utils.load、parser.parse、guess以及各作用域mock的应用和撤销，
+项目基准测试生成一个包含N个模块、每个测试M个mark、深层属性路径的项目，
+通过真实的fixture运行，统计吞吐量以及插件各阶段的耗时。
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import tempfile
+import argparse
+import subprocess
+
+from timeit import Timer
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import pytest
+
+from pytest_apistellar.utils import load, guess, Resolver, find_children
+from pytest_apistellar.patcher import process, Patcher, PropPatcher
+
+BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baseline.json")
+
+
+def write(filename, content):
+    dirname = os.path.dirname(filename)
+    if not os.path.exists(dirname):
+        os.makedirs(dirname)
+    with open(filename, "w") as f:
+        f.write(content)
+
+
+def deep_class(depth):
+    """
+    生成嵌套depth层的类定义，返回源码及最内层属性的路径
+    """
+    lines = []
+    names = []
+    for i in range(depth):
+        lines.append("    " * i + "class C%d(object):" % i)
+        names.append("C%d" % i)
+    indent = "    " * depth
+    lines.append(indent + "value = 1")
+    lines.append(indent + "def method(self) -> int:")
+    lines.append(indent + "    return 1")
+    return "\n".join(lines) + "\n", ".".join(names)
+
+
+def generate_project(root, modules, marks, depth, params):
+    """
+    生成一个合成项目
+    :param root: 项目目录
+    :param modules: 测试模块数
+    :param marks: 每个测试function级别的mark数量
+    :param depth: 被mock属性的嵌套深度
+    :param params: 每个测试的参数化个数
+    :return: 测试用例总数
+    """
+    src = os.path.join(root, "src")
+    write(os.path.join(src, "bench_app", "__init__.py"), "")
+    source, chain = deep_class(depth)
+    for i in range(modules):
+        write(os.path.join(src, "bench_app", "mod%d.py" % i), source)
+    write(os.path.join(src, "bench_factories.py"),
+          "def factory(*args, **kwargs):\n    return dict(a=1)\n")
+    write(os.path.join(root, "pytest.ini"), "\n".join([
+        "[pytest]",
+        "syspath =",
+        "    %s" % src,
+        "prop =",
+        "    bench_app.mod0.%s.value=2" % chain,
+        "usefixtures =",
+        "    mock",
+        ""]))
+    for i in range(modules):
+        target = "bench_app.mod%d.%s" % (i, chain)
+        lines = [
+            "import pytest",
+            "",
+            "pytestmark = [pytest.mark.prop('%s.value', ret_val=3)]" % target,
+            "",
+            "",
+            "class TestBench(object):",
+            "    pytestmark = [pytest.mark.env(BENCH_ENV='1')]",
+            "",
+        ]
+        decorators = ["    @pytest.mark.prop('%s.missing%d.attr', ret_val=%d)" % (
+            target, j, j) if j % 2 else
+                      "    @pytest.mark.prop('%s.method', ret_factory="
+                      "'bench_factories.factory')" % target
+                      for j in range(marks)]
+        lines.extend(decorators)
+        lines.append("    @pytest.mark.parametrize('n', range(%d))" % params)
+        lines.append("    def test_bench(self, n):")
+        lines.append("        pass")
+        write(os.path.join(root, "tests", "test_bench%d.py" % i),
+              "\n".join(lines) + "\n")
+    return modules * params
+
+
+def plugin_args():
+    """
+    插件已通过entry point安装时，不需要再手动加载
+    """
+    try:
+        from importlib.metadata import entry_points
+        eps = entry_points()
+        eps = eps.select(group="pytest11") if hasattr(eps, "select") \
+            else eps.get("pytest11", [])
+        if any(ep.value == "pytest_apistellar.plugins" for ep in eps):
+            return []
+    except ImportError:
+        pass
+    return ["-p", "pytest_apistellar.plugins"]
+
+
+def bench_project(args):
+    root = tempfile.mkdtemp(prefix="apistellar-bench-")
+    try:
+        count = generate_project(
+            root, args.modules, args.marks, args.depth, args.params)
+        profile = os.path.join(root, "profile.json")
+        env = dict(os.environ, PYTHONPATH=os.pathsep.join(
+            filter(None, [ROOT, os.environ.get("PYTHONPATH")])))
+        cmd = [sys.executable, "-m", "pytest", "-q", "-c",
+               os.path.join(root, "pytest.ini"), "--rootdir", root,
+               "-p", "no:cacheprovider", "-W", "ignore",
+               "--apistellar-profile-json", profile] + plugin_args() + [
+            os.path.join(root, "tests")]
+        start = time.time()
+        proc = subprocess.run(cmd, env=env, stdout=subprocess.PIPE,
+                              stderr=subprocess.STDOUT)
+        elapsed = time.time() - start
+        if proc.returncode:
+            raise RuntimeError(proc.stdout.decode())
+        with open(profile) as f:
+            stats = json.load(f)
+        phases = dict()
+        for stat in stats:
+            phases[stat["phase"]] = phases.get(stat["phase"], 0) + stat["total"]
+        results = {
+            "project.wall_per_test": elapsed / count,
+            "project.tests_per_second": count / elapsed,
+        }
+        for phase, total in phases.items():
+            results["project.%s_per_test" % phase] = total / count
+        return results
+    finally:
+        shutil.rmtree(root, ignore_errors=True)
+
+
+class Node(object):
+
+    def __init__(self, marks):
+        self.marks = marks
+
+    def iter_markers(self, name):
+        return [mark for mark in self.marks if mark.name == name]
+
+
+class Config(object):
+
+    def __init__(self, context=False):
+        self.context = context
+
+    def getini(self, name):
+        return name == "context_prop" and self.context
+
+
+class Request(object):
+    _arg2fixturedefs = dict()
+    fixturenames = ()
+
+    def __init__(self, scope, marks, context=False):
+        self.scope = scope
+        self.node = Node(marks)
+        self.config = Config(context)
+
+
+def timeit(func, number):
+    return min(Timer(func).repeat(3, number)) / number
+
+
+def bench_micro(args):
+    root = tempfile.mkdtemp(prefix="apistellar-micro-")
+    source, chain = deep_class(args.depth)
+    write(os.path.join(root, "bench_micro.py"), source)
+    sys.path.insert(0, root)
+    try:
+        import bench_micro
+        path = "bench_micro.%s.value" % chain
+        results = dict()
+        results["load.hit"] = timeit(lambda: load(path), args.number)
+
+        def load_miss():
+            resolver = Resolver()
+            resolver.load(path)
+        results["load.miss"] = timeit(load_miss, args.number)
+        results["guess.literal"] = timeit(
+            lambda: guess("{'a': [1, 2]}"), args.number)
+        results["guess.reference"] = timeit(
+            lambda: guess("os.path.join"), args.number)
+        results["guess.call"] = timeit(
+            lambda: guess("collections.OrderedDict(a=1)"), args.number)
+
+        missing = pytest.mark.prop(
+            "bench_micro.%s.%s.leaf" % (chain, ".".join(
+                "missing%d" % i for i in range(args.depth))), ret_val=1).mark
+
+        def parse_missing():
+            with PropPatcher([missing]) as patcher:
+                patcher.process_mark(missing, None)
+        results["parse.missing_ancestors"] = timeit(parse_missing, args.number)
+
+        constant = pytest.mark.prop(path, ret_val=1, callable=True).mark
+        factory = pytest.mark.prop(
+            path, 1, ret_factory=max, callable=True).mark
+        for name, mark in (("call.constant", constant),
+                           ("call.factory", factory)):
+            with PropPatcher([mark]) as patcher:
+                patcher.process_mark(mark, None)
+                stub = load(path)
+                results[name] = timeit(lambda: stub(0), args.number)
+
+        for scope in ("session", "module", "class", "function"):
+            marks = [pytest.mark.prop(path, ret_val=i).mark
+                     for i in range(args.marks)]
+
+            def apply():
+                # 非function作用域的mark只会处理一次，这里每次都使用新的Patcher状态
+                for patcher in find_children(Patcher):
+                    patcher.total_markers.clear()
+                gen = process(Request(scope, marks), Request(scope, marks))
+                next(gen)
+                gen.close()
+            results["process.%s" % scope] = timeit(apply, args.number)
+
+        def apply_context():
+            request = Request("function", marks, context=True)
+            gen = process(request, request)
+            next(gen)
+            gen.close()
+        results["process.function.context"] = timeit(
+            apply_context, args.number)
+        return results
+    finally:
+        sys.path.remove(root)
+        sys.modules.pop("bench_micro", None)
+        shutil.rmtree(root, ignore_errors=True)
+
+
+def bench_server(args):
+    try:
+        import apistellar
+    except ImportError:
+        return dict()
+    from pytest_apistellar.utils import create_server, stop_server
+
+    root = tempfile.mkdtemp(prefix="apistellar-server-")
+    old_path = os.getcwd()
+    try:
+        startup = shutdown = 0
+        for i in range(args.servers):
+            th, server = create_server(root)
+            startup += server.startup_time
+            stop_server(th, server)
+            shutdown += server.shutdown_time
+        return {"server.startup": startup / args.servers,
+                "server.shutdown": shutdown / args.servers}
+    finally:
+        os.chdir(old_path)
+        shutil.rmtree(root, ignore_errors=True)
+
+
+def compare(results, baseline, tolerance):
+    """
+    与基线对比，除吞吐量外数值越小越好
+    :return: 退化的指标列表
+    """
+    regressions = list()
+    for name, value in sorted(results.items()):
+        base = baseline.get(name)
+        if not base:
+            status = "new"
+        else:
+            ratio = base / value if name.endswith("per_second") else value / base
+            status = "%.2fx" % ratio
+            if ratio > tolerance:
+                status += " REGRESSION"
+                regressions.append(name)
+        print("%-40s %14.8f %14s %s" % (
+            name, value, "%.8f" % base if base else "-", status))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="pytest-apistellar benchmark")
+    parser.add_argument("--modules", type=int, default=20, help="测试模块数")
+    parser.add_argument("--marks", type=int, default=5, help="每个测试的mark数")
+    parser.add_argument("--depth", type=int, default=5, help="属性路径深度")
+    parser.add_argument("--params", type=int, default=20, help="参数化个数")
+    parser.add_argument("--number", type=int, default=1000, help="微基准测试循环次数")
+    parser.add_argument("--servers", type=int, default=5, help="server启停次数")
+    parser.add_argument("--baseline", default=BASELINE, help="基线文件")
+    parser.add_argument("--tolerance", type=float, default=1.5,
+                        help="超过基线多少倍视为性能退化")
+    parser.add_argument("--save", action="store_true", help="保存为基线")
+    parser.add_argument("--skip-project", action="store_true",
+                        help="不运行项目基准测试")
+    args = parser.parse_args()
+
+    results = bench_micro(args)
+    results.update(bench_server(args))
+    if not args.skip_project:
+        results.update(bench_project(args))
+
+    baseline = dict()
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+    print("%-40s %14s %14s %s" % ("benchmark", "current", "baseline", "ratio"))
+    regressions = compare(results, baseline, args.tolerance)
+    if args.save:
+        with open(args.baseline, "w") as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+        print("baseline saved to %s" % args.baseline)
+    elif regressions:
+        print("%d benchmark(s) regressed: %s" % (
+            len(regressions), ", ".join(regressions)))
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
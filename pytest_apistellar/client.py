@@ -0,0 +1,195 @@
+# -*- coding:utf-8 -*-
+import json
+import asyncio
+
+from urllib.parse import urlsplit, urlencode, unquote
+
+
+class ASGIResponse(object):
+    """
+    与aiohttp.ClientResponse常用接口兼容的响应对象
+    """
+    def __init__(self, status, headers, body):
+        self.status = status
+        self.headers = headers
+        self.body = body
+
+    @property
+    def content_type(self):
+        return self.headers.get("content-type", "").split(";")[0].strip()
+
+    @property
+    def charset(self):
+        for param in self.headers.get("content-type", "").split(";")[1:]:
+            key, _, val = param.strip().partition("=")
+            if key.lower() == "charset":
+                return val.strip("\"'")
+
+    async def read(self):
+        return self.body
+
+    async def text(self, encoding=None):
+        return self.body.decode(encoding or self.charset or "utf-8")
+
+    async def json(self, encoding=None, loads=json.loads, **kwargs):
+        return loads(await self.text(encoding))
+
+    def raise_for_status(self):
+        if self.status >= 400:
+            raise RuntimeError("%s: %s" % (self.status, self.body))
+
+    def release(self):
+        pass
+
+    def close(self):
+        pass
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        pass
+
+    def __repr__(self):
+        return "<ASGIResponse(status=%s)>" % self.status
+
+
+class RequestContext(object):
+    """
+    同时支持`await client.get(url)`和`async with client.get(url) as resp`两种用法
+    """
+    def __init__(self, coro):
+        self.coro = coro
+
+    def __await__(self):
+        return self.coro.__await__()
+
+    async def __aenter__(self):
+        return await self.coro
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        pass
+
+
+class ASGIClient(object):
+    """
+    直接通过ASGI接口调用app，不经过socket，请求接口与aiohttp.ClientSession兼容
+    """
+    def __init__(self, app, base_url="http://127.0.0.1"):
+        self.app = app
+        self.base_url = base_url
+        # apistellar(apistar)的app使用ASGI2.0接口: app(scope)(receive, send)
+        call = getattr(app, "__call__", app)
+        self.asgi3 = asyncio.iscoroutinefunction(app) or \
+            asyncio.iscoroutinefunction(call)
+
+    def request(self, method, url, params=None, data=None,
+                json=None, headers=None, **kwargs):
+        return RequestContext(
+            self._request(method, url, params, data, json, headers))
+
+    def get(self, url, **kwargs):
+        return self.request("GET", url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request("POST", url, **kwargs)
+
+    def put(self, url, **kwargs):
+        return self.request("PUT", url, **kwargs)
+
+    def patch(self, url, **kwargs):
+        return self.request("PATCH", url, **kwargs)
+
+    def delete(self, url, **kwargs):
+        return self.request("DELETE", url, **kwargs)
+
+    def head(self, url, **kwargs):
+        return self.request("HEAD", url, **kwargs)
+
+    def options(self, url, **kwargs):
+        return self.request("OPTIONS", url, **kwargs)
+
+    async def close(self):
+        pass
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        pass
+
+    def build_scope(self, method, url, params, headers):
+        parts = urlsplit(url if "://" in url else self.base_url + url)
+        query = parts.query
+        if params:
+            query = "&".join(filter(None, [query, urlencode(params)]))
+        default_port = 443 if parts.scheme == "https" else 80
+        headers = [(key.lower().encode("latin-1"), str(val).encode("latin-1"))
+                   for key, val in headers.items()]
+        if not any(key == b"host" for key, val in headers):
+            headers.insert(0, (b"host", parts.netloc.encode("latin-1")))
+        return {
+            "type": "http",
+            "asgi": {"version": "3.0" if self.asgi3 else "2.0"},
+            "http_version": "1.1",
+            "method": method.upper(),
+            "scheme": parts.scheme,
+            "path": unquote(parts.path or "/"),
+            "raw_path": (parts.path or "/").encode("latin-1"),
+            "query_string": query.encode("latin-1"),
+            "root_path": "",
+            "headers": headers,
+            "client": ("127.0.0.1", 0),
+            "server": (parts.hostname, parts.port or default_port),
+        }
+
+    async def _request(self, method, url, params, data, json_data, headers):
+        headers = dict(headers or dict())
+        if json_data is not None:
+            body = json.dumps(json_data).encode("utf-8")
+            headers.setdefault("Content-Type", "application/json")
+        elif isinstance(data, dict):
+            body = urlencode(data).encode("utf-8")
+            headers.setdefault(
+                "Content-Type", "application/x-www-form-urlencoded")
+        elif isinstance(data, str):
+            body = data.encode("utf-8")
+        else:
+            body = data or b""
+        if body:
+            headers.setdefault("Content-Length", len(body))
+
+        scope = self.build_scope(method, url, params, headers)
+        request_sent = False
+        finished = asyncio.Event()
+        response = {"status": None, "headers": dict(), "body": []}
+
+        async def receive():
+            nonlocal request_sent
+            if not request_sent:
+                request_sent = True
+                return {"type": "http.request", "body": body, "more_body": False}
+            # 响应结束后通知app客户端已断开
+            await finished.wait()
+            return {"type": "http.disconnect"}
+
+        async def send(message):
+            if message["type"] == "http.response.start":
+                response["status"] = message["status"]
+                response["headers"] = dict(
+                    (key.decode("latin-1").lower(), val.decode("latin-1"))
+                    for key, val in message.get("headers", []))
+            elif message["type"] == "http.response.body":
+                response["body"].append(message.get("body", b""))
+                if not message.get("more_body", False):
+                    finished.set()
+
+        try:
+            if self.asgi3:
+                await self.app(scope, receive, send)
+            else:
+                await self.app(scope)(receive, send)
+        finally:
+            finished.set()
+        return ASGIResponse(
+            response["status"], response["headers"], b"".join(response["body"]))
@@ -1,9 +1,88 @@
 import asyncio
 
+from .utils import make_key, missing
+
 
 def get_coroutine(ret_val):
     async def inner():
         if asyncio.iscoroutine(ret_val):
-            await ret_val
+            return await ret_val
         return ret_val
     return inner()
+
+
+def async_stand_in(ret_val, factory, args, kwargs, cache=None):
+    """
+    生成异步的替身函数
+    :param ret_val: 返回值
+    :param factory: 返回值生产工厂，工厂返回协程时会被await
+    :param args: 预先绑定的args
+    :param kwargs: 预先绑定的kwargs
+    :param cache: 缓存工厂await后的返回值的LRUCache
+    :return:
+    """
+    if not factory:
+        async def func(*_args, **_kwargs):
+            return ret_val
+    elif cache is not None:
+        async def func(*_args, **_kwargs):
+            _kwargs.update(kwargs)
+            _args += args
+            key = make_key(_args, _kwargs)
+            ret = cache.get(key)
+            if ret is missing:
+                ret = factory(*_args, **_kwargs)
+                if asyncio.iscoroutine(ret):
+                    ret = await ret
+                ret = cache.setdefault(key, ret)
+            return ret
+    elif args or kwargs:
+        async def func(*_args, **_kwargs):
+            _kwargs.update(kwargs)
+            ret = factory(*(_args + args), **_kwargs)
+            if asyncio.iscoroutine(ret):
+                ret = await ret
+            return ret
+    else:
+        async def func(*_args, **_kwargs):
+            ret = factory(*_args, **_kwargs)
+            if asyncio.iscoroutine(ret):
+                ret = await ret
+            return ret
+    return func
+
+
+def async_recorded(func, recorder):
+    """
+    返回调用时将参数记录到recorder中的异步函数，调用记录在协程开始执行时写入
+    :param func:
+    :param recorder:
+    :return:
+    """
+    async def wrapper(*args, **kwargs):
+        recorder.append(args, kwargs)
+        return await func(*args, **kwargs)
+    return wrapper
+
+
+def get_test_server(ready, signals=False):
+    """
+    返回测试用的server类
+    :param ready: server开始监听后被设置的Event
+    :param signals: 是否注册信号，在子进程的主线程中运行时使用
+    :return:
+    """
+    from uvicorn.main import Server
+
+    class TestServer(Server):
+        if not signals:
+            # 子线程无法注册信号
+            def install_signal_handlers(self):
+                pass
+
+        async def startup(self, *args, **kwargs):
+            await super(TestServer, self).startup(*args, **kwargs)
+            # socket开始监听后通知主线程
+            ready.set()
+
+    return TestServer
@@ -0,0 +1,137 @@
+# -*- coding:utf-8 -*-
+import inspect
+
+from functools import wraps
+from contextvars import ContextVar
+
+from .utils import missing
+
+# 当前上下文中生效的mock，key为(id(owner), name)，value为mock的值
+mocks = ContextVar("apistellar_mocks", default=None)
+
+
+class ContextAttribute(object):
+    """
+    安装在类上的分发描述符，当前上下文中有mock时返回mock的值，否则返回原属性
+    """
+
+    def __init__(self, owner, name, key, original):
+        self.owner = owner
+        self.name = name
+        self.key = key
+        self.original = original
+
+    def __get__(self, instance, owner):
+        values = mocks.get()
+        value = values.get(self.key, missing) if values else missing
+        if value is missing:
+            value = self.original
+            if value is missing:
+                # 原属性是继承来的
+                for klass in self.owner.__mro__[1:]:
+                    if self.name in klass.__dict__:
+                        value = klass.__dict__[self.name]
+                        break
+                else:
+                    raise AttributeError(self.name)
+        # 与直接设置在类上的属性保持一致的绑定行为
+        get = getattr(type(value), "__get__", None)
+        if get is not None:
+            return get(value, instance, owner)
+        return value
+
+    def __repr__(self):
+        return "<ContextAttribute(owner=%r name=%s)>" % (self.owner, self.name)
+
+
+def module_dispatcher(key, original):
+    """
+    生成安装在模块上的分发函数，当前上下文中有mock时调用mock，否则调用原函数
+    :param key:
+    :param original: 原函数
+    :return:
+    """
+    if inspect.iscoroutinefunction(original):
+        @wraps(original)
+        async def dispatch(*args, **kwargs):
+            values = mocks.get()
+            func = values.get(key, original) if values else original
+            ret = func(*args, **kwargs)
+            if inspect.isawaitable(ret):
+                ret = await ret
+            return ret
+    else:
+        @wraps(original)
+        def dispatch(*args, **kwargs):
+            values = mocks.get()
+            func = values.get(key, original) if values else original
+            return func(*args, **kwargs)
+    return dispatch
+
+
+class Dispatcher(object):
+    """
+    每个(owner, name)只安装一次分发器，使用引用计数，
+    最后一个使用者释放后恢复原属性。
+    """
+
+    def __init__(self):
+        # key: [owner, name, original, stand_in, refcount]
+        self.installs = dict()
+
+    @staticmethod
+    def installed(install):
+        owner, name, original, stand_in, refcount = install
+        return owner.__dict__.get(name, missing) is stand_in
+
+    def acquire(self, owner, name, value):
+        """
+        为owner.name安装分发器，无法分发时返回None
+        :param owner: 类或模块
+        :param name:
+        :param value: mock的值
+        :return: key
+        """
+        key = (id(owner), name)
+        install = self.installs.get(key)
+        if install is not None and self.installed(install):
+            install[4] += 1
+            return key
+
+        original = owner.__dict__.get(name, missing)
+        if inspect.isclass(owner):
+            stand_in = ContextAttribute(owner, name, key, original)
+        elif inspect.ismodule(owner) and callable(original) and \
+                callable(value):
+            stand_in = module_dispatcher(key, original)
+        else:
+            return None
+        try:
+            setattr(owner, name, stand_in)
+        except (TypeError, AttributeError):
+            return None
+        # 分发器被其它mock覆盖过时重新安装，保留之前的引用计数
+        self.installs[key] = [owner, name, original, stand_in,
+                              (install[4] if install else 0) + 1]
+        return key
+
+    def release(self, key):
+        """
+        释放分发器，没有使用者时恢复原属性
+        :param key:
+        :return:
+        """
+        install = self.installs[key]
+        install[4] -= 1
+        if install[4] > 0:
+            return
+        del self.installs[key]
+        owner, name, original = install[:3]
+        if self.installed(install):
+            if original is missing:
+                delattr(owner, name)
+            else:
+                setattr(owner, name, original)
+
+
+dispatcher = Dispatcher()
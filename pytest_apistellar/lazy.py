@@ -0,0 +1,145 @@
+# -*- coding:utf-8 -*-
+import sys
+
+from importlib.util import find_spec
+
+
+class Pending(object):
+    """
+    等待被mock对象所属模块导入的mock
+    """
+    def __init__(self, owner, path, callback):
+        """
+        :param owner: 记录该mock的对象，用来批量取消
+        :param path: 被mock属性的拥有者路径
+        :param callback: 模块导入完成后执行的回调
+        """
+        self.owner = owner
+        self.path = path
+        self.callback = callback
+        self.done = False
+
+
+class LazyLoader(object):
+    """
+    包装原loader，在模块执行完毕后应用等待中的mock
+    """
+    def __init__(self, loader, finder):
+        self.loader = loader
+        self.finder = finder
+
+    def __getattr__(self, item):
+        return getattr(self.loader, item)
+
+    def create_module(self, spec):
+        return self.loader.create_module(spec)
+
+    def exec_module(self, module):
+        # 执行前还原loader，避免模块对外暴露包装后的loader
+        module.__loader__ = self.loader
+        if getattr(module, "__spec__", None) is not None:
+            module.__spec__.loader = self.loader
+        self.loader.exec_module(module)
+        self.finder.install(module.__name__)
+
+
+class LazyFinder(object):
+    """
+    元路径查找器，记录等待中的mock，在其所属模块导入完成时应用。
+    """
+    def __init__(self):
+        # 模块名: [Pending]
+        self.pending = dict()
+
+    def find_spec(self, fullname, path, target=None):
+        if fullname not in self.pending:
+            return None
+
+        for finder in sys.meta_path:
+            if finder is self or not hasattr(finder, "find_spec"):
+                continue
+            spec = finder.find_spec(fullname, path, target)
+            if spec is not None:
+                if hasattr(spec.loader, "exec_module"):
+                    spec.loader = LazyLoader(spec.loader, self)
+                return spec
+
+    def defer(self, path, owner, callback):
+        """
+        若path的所属模块还未导入，记录回调并返回True，否则返回False
+        :param path: 被mock属性的拥有者路径
+        :param owner:
+        :param callback:
+        :return:
+        """
+        pending = Pending(owner, path, callback)
+        names = list()
+        name = path
+        while name:
+            if name in sys.modules:
+                if self.ready(pending, name):
+                    return False
+                break
+            names.append(name)
+            name = name.rpartition(".")[0]
+
+        for name in names:
+            self.pending.setdefault(name, list()).append(pending)
+        if self not in sys.meta_path:
+            sys.meta_path.insert(0, self)
+        return True
+
+    @staticmethod
+    def ready(pending, name):
+        """
+        模块name导入完成后，判断是否可以应用mock
+        :param pending:
+        :param name: 已导入的模块名
+        :return:
+        """
+        rest = pending.path[len(name):].lstrip(".")
+        if not rest:
+            return True
+        module = sys.modules[name]
+        attr = rest.split(".", 1)[0]
+        if hasattr(module, attr):
+            return True
+        # 下一级是还没导入的子模块，需要等待子模块导入
+        if hasattr(module, "__path__"):
+            try:
+                return find_spec("%s.%s" % (name, attr)) is None
+            except (ImportError, ValueError):
+                return True
+        return True
+
+    def install(self, name):
+        """
+        模块导入完成后，应用等待该模块的mock
+        :param name:
+        :return:
+        """
+        for pending in self.pending.pop(name, list()):
+            if not pending.done and self.ready(pending, name):
+                pending.done = True
+                pending.callback()
+        self.discard(None)
+
+    def discard(self, owner):
+        """
+        取消owner记录的所有mock，同时清理已经应用过的mock
+        :param owner:
+        :return:
+        """
+        for name, pendings in list(self.pending.items()):
+            pendings[:] = [p for p in pendings
+                           if p.owner is not owner and not p.done]
+            if not pendings:
+                del self.pending[name]
+        self.uninstall()
+
+    def uninstall(self):
+        if not self.pending and self in sys.meta_path:
+            sys.meta_path.remove(self)
+
+
+finder = LazyFinder()
@@ -0,0 +1,372 @@
+# -*- coding:utf-8 -*-
+import json
+import math
+import time
+import asyncio
+
+from urllib.parse import urlencode
+
+
+class Histogram(object):
+    """
+    对数分桶的延迟直方图，桶的个数在创建时确定，记录多少个值内存占用都不变，
+    百分位数的相对误差不超过precision。
+    """
+
+    def __init__(self, lowest=1e-6, highest=60.0, precision=0.01):
+        """
+        :param lowest: 可区分的最小值(秒)，更小的值计入第一个桶
+        :param highest: 可区分的最大值(秒)，更大的值计入最后一个桶
+        :param precision: 相对误差
+        """
+        self.lowest = lowest
+        self.base = math.log(1 + precision)
+        self.counts = [0] * (int(math.ceil(
+            math.log(highest / lowest) / self.base)) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.min = None
+        self.max = None
+
+    def index(self, value):
+        if value <= self.lowest:
+            return 0
+        return min(int(math.ceil(math.log(value / self.lowest) / self.base)),
+                   len(self.counts) - 1)
+
+    def record(self, value):
+        self.counts[self.index(value)] += 1
+        self.count += 1
+        self.total += value
+        if self.min is None or value < self.min:
+            self.min = value
+        if self.max is None or value > self.max:
+            self.max = value
+
+    def percentile(self, percent):
+        """
+        返回百分位数，取所在桶的上界
+        :param percent: 0-100
+        :return:
+        """
+        if not self.count:
+            return None
+        rank = max(int(math.ceil(self.count * percent / 100.0)), 1)
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank:
+                # 最后一个桶没有上界
+                if index == len(self.counts) - 1:
+                    return self.max
+                upper = self.lowest * math.exp(index * self.base)
+                return max(min(upper, self.max), self.min)
+        return self.max
+
+    @property
+    def mean(self):
+        return self.total / self.count if self.count else None
+
+    def to_dict(self):
+        return {"count": self.count, "min": self.min, "mean": self.mean,
+                "p50": self.percentile(50), "p90": self.percentile(90),
+                "p95": self.percentile(95), "p99": self.percentile(99),
+                "max": self.max}
+
+
+class LoadResult(object):
+    """
+    一次压测的结果
+    """
+
+    def __init__(self, name, method, url, mode):
+        self.name = name
+        self.method = method
+        self.url = url
+        self.mode = mode
+        self.latency = Histogram()
+        # status: 响应数
+        self.status = dict()
+        # 连接失败、响应不完整等异常的次数
+        self.errors = 0
+        self.duration = 0.0
+
+    def record(self, latency, status):
+        self.latency.record(latency)
+        self.status[status] = self.status.get(status, 0) + 1
+
+    @property
+    def requests(self):
+        return self.latency.count + self.errors
+
+    @property
+    def throughput(self):
+        """
+        每秒完成的请求数
+        :return:
+        """
+        return self.latency.count / self.duration if self.duration else 0.0
+
+    @property
+    def p50(self):
+        return self.latency.percentile(50)
+
+    @property
+    def p95(self):
+        return self.latency.percentile(95)
+
+    @property
+    def p99(self):
+        return self.latency.percentile(99)
+
+    def to_dict(self):
+        return {"name": self.name, "method": self.method, "url": self.url,
+                "mode": self.mode, "requests": self.requests,
+                "errors": self.errors, "duration": self.duration,
+                "throughput": self.throughput,
+                "status": dict((str(k), v) for k, v in self.status.items()),
+                "latency": self.latency.to_dict()}
+
+    def dump(self, filename):
+        with open(filename, "w") as f:
+            json.dump(self.to_dict(), f, indent=2)
+
+    def __repr__(self):
+        return "<LoadResult(name=%s requests=%s errors=%s throughput=%.1f " \
+               "p50=%s p99=%s)>" % (self.name, self.requests, self.errors,
+                                    self.throughput, self.p50, self.p99)
+
+
+class Connection(object):
+    """
+    HTTP/1.1 keep-alive连接，断开后在下一次请求时重连
+    """
+
+    def __init__(self, host=None, port=None, uds=None):
+        self.host = host
+        self.port = port
+        self.uds = uds
+        self.reader = None
+        self.writer = None
+
+    async def open(self):
+        if self.uds:
+            self.reader, self.writer = await asyncio.open_unix_connection(
+                self.uds)
+        else:
+            self.reader, self.writer = await asyncio.open_connection(
+                self.host, self.port)
+
+    async def request(self, data, head=False):
+        """
+        发送已编码的请求，读取完整的响应
+        :param data: 编码好的请求
+        :param head: 是否是HEAD请求，HEAD请求的响应没有body
+        :return: status
+        """
+        if self.writer is None:
+            await self.open()
+        self.writer.write(data)
+        reader = self.reader
+        line = await reader.readline()
+        if not line:
+            raise ConnectionError("Connection closed by server.")
+        status = int(line.split()[1])
+        length = None
+        chunked = close = False
+        while True:
+            line = await reader.readline()
+            if line in (b"\r\n", b"\n", b""):
+                break
+            name, _, value = line.partition(b":")
+            name = name.strip().lower()
+            value = value.strip().lower()
+            if name == b"content-length":
+                length = int(value)
+            elif name == b"transfer-encoding":
+                chunked = b"chunked" in value
+            elif name == b"connection":
+                close = value == b"close"
+
+        if head or status in (204, 304) or 100 <= status < 200:
+            pass
+        elif chunked:
+            while True:
+                size = int((await reader.readline()).split(b";")[0], 16)
+                # 每个chunk后有一个\r\n，最后一个chunk后没有trailer
+                await reader.readexactly(size + 2)
+                if not size:
+                    break
+        elif length is not None:
+            await reader.readexactly(length)
+        else:
+            await reader.read()
+            close = True
+
+        if close:
+            self.close()
+        return status
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+        self.reader = self.writer = None
+
+
+class LoadGenerator(object):
+    """
+    对测试server发起并发请求，统计延迟分布及吞吐量。
+    不指定rate时为闭环模式，concurrency个连接各自连续发起请求；
+    指定rate时按固定速率发起请求，延迟从计划发起的时间开始计算，
+    连接不够用时的排队时间也计入延迟。
+    """
+
+    def __init__(self, config, on_result=None):
+        """
+        :param config: server的config，需要有host, port, uds属性
+        :param on_result: 每次压测完成后使用LoadResult调用
+        """
+        self.host = getattr(config, "host", None) or "127.0.0.1"
+        self.port = getattr(config, "port", None)
+        self.uds = getattr(config, "uds", None)
+        self.on_result = on_result
+
+    def __call__(self, *args, **kwargs):
+        """
+        同步执行一次压测，参数同run
+        :return: LoadResult
+        """
+        loop = asyncio.new_event_loop()
+        try:
+            return loop.run_until_complete(self.run(*args, **kwargs))
+        finally:
+            loop.close()
+
+    def encode(self, method, path, params=None, headers=None, body=None):
+        if params:
+            path += ("&" if "?" in path else "?") + urlencode(params)
+        if isinstance(body, (dict, list)):
+            body = json.dumps(body)
+            headers = dict({"Content-Type": "application/json"},
+                           **(headers or dict()))
+        if isinstance(body, str):
+            body = body.encode("utf-8")
+        body = body or b""
+        lines = ["%s %s HTTP/1.1" % (method.upper(), path),
+                 "Host: %s" % (self.host if self.uds or not self.port
+                               else "%s:%s" % (self.host, self.port)),
+                 "Connection: keep-alive",
+                 "Content-Length: %d" % len(body)]
+        for key, val in (headers or dict()).items():
+            lines.append("%s: %s" % (key, val))
+        return ("\r\n".join(lines) + "\r\n\r\n").encode("latin-1") + body
+
+    async def run(self, path="/", method="GET", requests=None, duration=None,
+                  concurrency=10, rate=None, params=None, headers=None,
+                  body=None, name=None):
+        """
+        :param path: 请求路径
+        :param method:
+        :param requests: 请求总数，与duration都不指定时为1000
+        :param duration: 压测时长(秒)
+        :param concurrency: 连接数
+        :param rate: 每秒发起的请求数，不指定时为闭环模式
+        :param params: query参数
+        :param headers:
+        :param body: 请求体，dict或list会被序列化成json
+        :param name: 报告中的名称，默认为"method path"
+        :return: LoadResult
+        """
+        if requests is None and duration is None:
+            requests = 1000
+        data = self.encode(method, path, params, headers, body)
+        head = method.upper() == "HEAD"
+        result = LoadResult(
+            name or "%s %s" % (method.upper(), path), method.upper(),
+            "%s%s" % (self.uds or "http://%s:%s" % (self.host, self.port),
+                      path), "rate" if rate else "closed")
+        connections = [Connection(self.host, self.port, self.uds)
+                       for _ in range(concurrency)]
+        loop = asyncio.get_event_loop()
+        start = loop.time()
+        deadline = start + duration if duration else None
+        try:
+            if rate:
+                await self.open_loop(connections, data, head, result,
+                                     requests, deadline, rate)
+            else:
+                await self.closed_loop(connections, data, head, result,
+                                       requests, deadline)
+        finally:
+            result.duration = loop.time() - start
+            for connection in connections:
+                connection.close()
+        if self.on_result:
+            self.on_result(result)
+        return result
+
+    async def send(self, connection, data, head, result, start):
+        loop = asyncio.get_event_loop()
+        try:
+            status = await connection.request(data, head)
+        except (OSError, ValueError, IndexError, asyncio.IncompleteReadError):
+            connection.close()
+            result.errors += 1
+        else:
+            result.record(loop.time() - start, status)
+
+    async def closed_loop(self, connections, data, head, result,
+                          requests, deadline):
+        loop = asyncio.get_event_loop()
+        issued = [0]
+
+        async def worker(connection):
+            while (requests is None or issued[0] < requests) and \
+                    (deadline is None or loop.time() < deadline):
+                issued[0] += 1
+                await self.send(connection, data, head, result, loop.time())
+
+        await asyncio.gather(*[worker(conn) for conn in connections])
+
+    async def open_loop(self, connections, data, head, result,
+                        requests, deadline, rate):
+        loop = asyncio.get_event_loop()
+        idle = asyncio.Queue()
+        for connection in connections:
+            idle.put_nowait(connection)
+
+        async def send(connection, scheduled):
+            try:
+                await self.send(connection, data, head, result, scheduled)
+            finally:
+                idle.put_nowait(connection)
+
+        # 只保留未完成的请求，长时间压测时内存不会增长
+        pending = set()
+        start = loop.time()
+        index = 0
+        while requests is None or index < requests:
+            scheduled = start + index / float(rate)
+            if deadline is not None and scheduled >= deadline:
+                break
+            delay = scheduled - loop.time()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            connection = await idle.get()
+            task = asyncio.ensure_future(send(connection, scheduled))
+            pending.add(task)
+            task.add_done_callback(pending.discard)
+            index += 1
+        if pending:
+            await asyncio.gather(*pending)
+
+
+def dump_reports(filename, reports):
+    """
+    将所有压测结果保存为json文件
+    :param filename:
+    :param reports: [dict]
+    :return:
+    """
+    with open(filename, "w") as f:
+        json.dump({"created": time.time(), "results": reports}, f, indent=2)
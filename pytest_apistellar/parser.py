@@ -1,8 +1,11 @@
 # -*- coding:utf-8 -*-
-import re
+import sys
+import inspect
 import traceback
 
-from .utils import load
+from functools import partial
+
+from .utils import load, walk, find_module, make_key, missing
 
 
 class Attr(object):
@@ -10,6 +13,14 @@ class Attr(object):
 
 
 class Prop(object):
+    """
+    被mock属性的描述，创建后不可修改，需要修改时通过replace生成新的Prop。
+    asyncable, callable, signature, annotations在编译时推断后赋予，
+    recorder, cache在应用时赋予。
+    """
+    __slots__ = ("obj", "name", "args", "kwargs", "ret_val", "ret_factory",
+                 "asyncable", "callable", "signature", "annotations",
+                 "recorder", "cache")
 
     def __init__(self, obj, _name, args, ret_val=None, ret_factory=None, **kwargs):
         """
@@ -21,53 +32,67 @@ class Prop(object):
         :param callable: 被mock的属性是否是可调用的
         :param kwargs: mark传入的kwargs参数
         """
-        self.obj = obj
-        self.name = _name
-        self.ret_val = ret_val
-        self.ret_factory = load(ret_factory) \
-            if isinstance(ret_factory, str) else ret_factory
+        setter = partial(object.__setattr__, self)
+        setter("obj", obj)
+        setter("name", _name)
+        setter("ret_val", ret_val)
+        setter("ret_factory", load(ret_factory)
+               if isinstance(ret_factory, str) else ret_factory)
         # 优先使用手动指定的标志位
         if "asyncable" in kwargs:
-            self.asyncable = kwargs.pop("asyncable")
+            setter("asyncable", kwargs.pop("asyncable"))
 
         if "callable" in kwargs:
-            self.callable = kwargs.pop("callable")
+            setter("callable", kwargs.pop("callable"))
+
+        setter("args", args or tuple())
+        setter("kwargs", kwargs or dict())
+
+    def __setattr__(self, key, value):
+        raise AttributeError("Prop is immutable, use replace instead.")
 
-        self.args = args or tuple()
-        self.kwargs = kwargs or dict()
+    __delattr__ = __setattr__
+
+    def replace(self, **changes):
+        """
+        返回替换了部分属性的新Prop
+        :param changes:
+        :return:
+        """
+        prop = object.__new__(self.__class__)
+        for slot in self.__slots__:
+            val = changes.get(slot, getattr(self, slot, missing))
+            if val is not missing:
+                object.__setattr__(prop, slot, val)
+        return prop
 
     def __iter__(self):
         try:
             yield self.obj
             yield self.name
             if self.callable:
-                yield self
+                yield stand_in(self)
+            elif self.ret_factory:
+                cache = getattr(self, "cache", None)
+                if cache is None:
+                    yield self.ret_factory()
+                else:
+                    val = cache.get(())
+                    if val is missing:
+                        val = cache.setdefault((), self.ret_factory())
+                    yield val
             else:
-                if self.ret_factory:
-                    self.ret_val = self.ret_factory()
                 yield self.ret_val
         except Exception as e:
             traceback.print_exc()
             raise e
 
-    def __call__(self, *args, **kwargs):
-        kwargs.update(self.kwargs)
-        if self.ret_factory:
-            ret_val = self.ret_factory(*(args + self.args), **kwargs)
-        else:
-            ret_val = self.ret_val
-
-        if self.asyncable:
-            from .compact import get_coroutine
-            return get_coroutine(ret_val)
-        else:
-            return ret_val
-
     def __str__(self):
-        kwargs = self.__dict__.copy()
-        # 有可能还没asyncable, callable这两个属性，因为这两个属性是在process_mark时赋予的。
-        kwargs.setdefault("asyncable", False)
-        kwargs.setdefault("callable", False)
+        kwargs = dict((slot, getattr(self, slot, None))
+                      for slot in self.__slots__)
+        # 有可能还没asyncable, callable这两个属性，因为这两个属性是在编译时赋予的。
+        kwargs["asyncable"] = kwargs["asyncable"] or False
+        kwargs["callable"] = kwargs["callable"] or False
         return "<Prop(name={name} obj={obj} asyncable={asyncable} " \
                "callable={callable} kwargs={kwargs} ret_val={ret_val} " \
                "ret_factory={ret_factory})>".format(**kwargs)
@@ -75,27 +100,155 @@ class Prop(object):
     __repr__ = __str__
 
 
-def parse(mock, args, kwargs=None, regex=re.compile(r" no[\w\s]+?(['\"])(\w+)\1")):
+def stand_in(prop):
+    """
+    生成可调用属性的替身函数，按prop的性质特化：
+    常量返回值直接返回，异步的使用async def，工厂预先绑定args和kwargs，
+    指定了cache的工厂按调用参数缓存返回值。
+    :param prop:
+    :return:
+    """
+    ret_val, factory = prop.ret_val, prop.ret_factory
+    args, kwargs = prop.args, prop.kwargs
+    cache = getattr(prop, "cache", None)
+    if prop.asyncable:
+        from .compact import async_stand_in
+        func = async_stand_in(ret_val, factory, args, kwargs, cache)
+    elif not factory:
+        def func(*_args, **_kwargs):
+            return ret_val
+    elif cache is not None:
+        def func(*_args, **_kwargs):
+            _kwargs.update(kwargs)
+            _args += args
+            key = make_key(_args, _kwargs)
+            val = cache.get(key)
+            if val is missing:
+                val = cache.setdefault(key, factory(*_args, **_kwargs))
+            return val
+    elif args or kwargs:
+        def func(*_args, **_kwargs):
+            _kwargs.update(kwargs)
+            return factory(*(_args + args), **_kwargs)
+    else:
+        def func(*_args, **_kwargs):
+            return factory(*_args, **_kwargs)
+
+    recorder = getattr(prop, "recorder", None)
+    if recorder is not None:
+        func = recorded(func, recorder, prop.asyncable)
+
+    func.prop = prop
+    func.asyncable = prop.asyncable
+    func.callable = prop.callable
+    # apistellar的依赖注入需要return的signature
+    if hasattr(prop, "signature"):
+        func.__signature__ = prop.signature
+        func.__annotations__ = prop.annotations
+    # 类属性是函数时会被绑定成方法，需要包装成staticmethod
+    if inspect.isclass(prop.obj):
+        return staticmethod(func)
+    return func
+
+
+def recorded(func, recorder, asyncable=False):
+    """
+    返回调用时将参数记录到recorder中的func
+    :param func:
+    :param recorder: CallRecorder
+    :param asyncable: func是否是异步的
+    :return:
+    """
+    if asyncable:
+        from .compact import async_recorded
+        return async_recorded(func, recorder)
+
+    def wrapper(*args, **kwargs):
+        recorder.append(args, kwargs)
+        return func(*args, **kwargs)
+    return wrapper
+
+
+class Plan(object):
     """
-    将mark转换成prop
+    mark编译后的mock计划，保存解析好的Prop，重复应用mark时直接重放。
+    当被mock对象所在模块被重新加载，或属性拥有者被替换后，计划失效。
+    """
+
+    def __init__(self, path, props):
+        """
+        :param path: 被mock的属性路径
+        :param props: 编译好的Prop列表，最后一个之前的都是占位祖先
+        """
+        self.props = props
+        self.module = find_module(path)
+        self.spec = getattr(self.module, "__spec__", None)
+        # 第一个prop的拥有者的路径，每个prop对应路径中的一级
+        self.owner = path.rsplit(".", len(props))[0]
+
+    @property
+    def valid(self):
+        # reload会重新查找spec并赋值给模块，所以可以通过spec来判断模块是否被重新加载过
+        if self.module is None or \
+                sys.modules.get(self.module.__name__) is not self.module or \
+                getattr(self.module, "__spec__", None) is not self.spec:
+            return False
+        # 拥有者可能被替换了，如monkeypatch.setattr(module, "obj", ...)
+        try:
+            return load(self.owner) is self.props[0].obj
+        except (ImportError, AttributeError):
+            return False
+
+    def replay(self):
+        """
+        重放计划。占位祖先如果已经存在(如同一作用域中共享前缀的mark已经生成过)，
+        则复用已存在的对象，不再生成新的占位。
+        :return:
+        """
+        obj = self.props[0].obj
+        for prop in self.props[:-1]:
+            attr = getattr(obj, prop.name, missing)
+            if attr is missing:
+                yield retarget(prop, obj)
+                attr = prop.ret_val
+            obj = attr
+        yield retarget(self.props[-1], obj)
+
+
+def retarget(prop, obj):
+    """
+    返回属性拥有者为obj的prop
+    :param prop:
+    :param obj:
+    :return:
+    """
+    if prop.obj is not obj:
+        prop = prop.replace(obj=obj)
+    return prop
+
+
+def parse(mock, args, kwargs=None):
+    """
+    将mark转换成prop，沿路径只查找一次，找到已存在的最深对象后，
+    为其后缺失的祖先依次生成占位的Attr。
+    已存在的占位祖先(同一作用域中共享前缀的mark生成的)同样会生成占位，
+    保证第一个prop的拥有者是真实存在的对象，重放时已存在的占位会被复用。
     :param mock:
     :param args:
     :param kwargs:
-    :param regex: 祖先不存在时用来mock祖先，使用一个正则来将祖先的名称找出
     :return:
     """
-
     obj_name, _, prop = mock.rpartition(".")
-
-    while True:
-        try:
-            obj = load(obj_name)
-            yield Prop(obj, prop, args, **kwargs)
-            break
-        except AttributeError as ex:
-            ancestor = regex.search(str(ex)).group(2)
-            _obj_name, last = re.split(ancestor, obj_name, 1)
-
-            for mock_prop in parse(
-                    _obj_name + ancestor, tuple(), {"ret_val": Attr()}):
-                yield mock_prop
+    obj, ancestors = walk(obj_name)
+    if ancestors:
+        obj_name = obj_name.rsplit(".", len(ancestors))[0]
+    while isinstance(obj, Attr):
+        obj_name, _, ancestor = obj_name.rpartition(".")
+        ancestors.insert(0, ancestor)
+        obj = load(obj_name)
+
+    for ancestor in ancestors:
+        attr = Attr()
+        yield Prop(obj, ancestor, tuple(), ret_val=attr)
+        obj = attr
+    yield Prop(obj, prop, args, **kwargs)
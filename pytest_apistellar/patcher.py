@@ -1,7 +1,10 @@
 # -*- coding:utf-8 -*-
 import re
 import os
+import ast
 import six
+import json
+import hashlib
 import pytest
 import inspect
 
@@ -11,14 +14,44 @@ from abc import ABCMeta, abstractmethod
 from _pytest.mark import Mark
 from _pytest.monkeypatch import MonkeyPatch
 
-from .parser import parse
-from .utils import load, cache_classproperty, MarkerWrapper, guess, find_children
+from . import __version__
+from .lazy import finder
+from .parser import parse, Plan
+from .profiler import profiler
+from .recorder import CallRecorder
+from .utils import load, cache_classproperty, MarkerWrapper, find_children, \
+    Value, LRUCache, lazy_value, resolve, missing
 
 namespace = {"function": 10, "class": 20, "package": 30, "module": 40, "session": 50}
 
 
+class FixtureInjector(object):
+    """
+    工厂第一次被调用时才从request中获取其需要的fixture，获取后的值在本次mock中保持不变
+    """
+    def __init__(self, func, request, names):
+        self.func = func
+        self.request = request
+        self.names = names
+        self.fixture_kwargs = None
+
+    def __call__(self, *args, **kwargs):
+        if self.fixture_kwargs is None:
+            self.fixture_kwargs = dict(
+                (name, self.request.getfixturevalue(name))
+                for name in self.names)
+        for name, val in self.fixture_kwargs.items():
+            kwargs.setdefault(name, val)
+        return self.func(*args, **kwargs)
+
+    def __repr__(self):
+        return "<FixtureInjector(func=%r names=%r)>" % (self.func, self.names)
+
+
 @six.add_metaclass(ABCMeta)
 class Patcher(object):
+    # config_dump的序列化格式版本，格式变化时递增，与插件版本一起使旧的缓存失效
+    config_format = 2
 
     @property
     @abstractmethod
@@ -33,30 +66,40 @@ class Patcher(object):
         """
         由于iter_markers会返回所有scope下的mark，
         所以使用这个属性来保证每个markers只处理一次，
+        value为处理mark的作用域。function级别的mark不需要过滤，所以不记录，
+        其它作用域的mark在该作用域结束时释放。
         :return:
         :rtype: dict
         """
         return dict()
 
-    def __init__(self, markers):
-        self.monkey_patch = MonkeyPatch()
+    def __init__(self, markers, monkey_patch=None):
+        """
+        :param markers:
+        :param monkey_patch: 同一作用域的patcher共用一个MonkeyPatch，统一撤销
+        """
+        self.monkey_patch = monkey_patch or MonkeyPatch()
         self.markers = markers
+        # 本patcher记录到total_markers中的mark，close时释放
+        self.recorded = list()
 
     def __enter__(self):
         return self
 
     def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
         self.monkey_patch.undo()
 
-    def process(self, request):
-        fixture_kwargs = dict()
-        # 只有PropPatcher才需要注入fixture。
-        if self.name == "prop":
-            for name, fixture in request._fixture_defs.items():
-                # 当前请求作用域适用于该fixture的作用域
-                if namespace[request.scope] <= namespace[fixture.scope]:
-                    fixture_kwargs[name] = request.getfixturevalue(name)
+    def close(self):
+        """
+        释放patcher持有的资源，mock的撤销由MonkeyPatch统一完成
+        :return:
+        """
+        for mark_wrapper in self.recorded:
+            self.total_markers.pop(mark_wrapper, None)
+        del self.recorded[:]
 
+    def process(self, request):
         for mark in self.markers:
             mark_wrapper = MarkerWrapper(mark)
             # 由于当前request可获得的markers包括大于等于当前作用域的所有marker。
@@ -64,15 +107,42 @@ class Patcher(object):
             # 其它作用域已经处理过一些mark，这些mark需要过滤掉，
             # 但在执行时若使用了多输入的fixture，会出现请求重复发起的情况，
             # 此时需要重复执行mock， 因此，不能对function级别的mark进行过滤。
-            if mark_wrapper not in self.total_markers or \
-                    self.total_markers[mark_wrapper] == "function":
-                self.process_mark(mark, fixture_kwargs)
-                self.total_markers[mark_wrapper] = request.scope
+            if mark_wrapper not in self.total_markers:
+                with profiler.timer("process_mark", self.describe(mark)):
+                    self.process_mark(mark, request)
+                self.record(mark_wrapper, request)
+
+    def record(self, mark_wrapper, request):
+        """
+        记录已处理的mark，function级别的mark每次都要处理，不记录
+        :param mark_wrapper:
+        :param request:
+        :return:
+        """
+        if request is not None and request.scope != "function":
+            self.total_markers[mark_wrapper] = request.scope
+            self.recorded.append(mark_wrapper)
+
+    def describe(self, mark):
+        """
+        返回mark所mock的对象的描述，用于统计耗时
+        :param mark:
+        :return:
+        """
+        if not mark.args:
+            target = ",".join(mark.kwargs)
+        elif isinstance(mark.args[0], six.string_types):
+            target = mark.args[0]
+        else:
+            target = type(mark.args[0]).__name__
+        return "%s:%s" % (self.name, target)
 
     @abstractmethod
-    def process_mark(self, mark, fixture_kwargs):
+    def process_mark(self, mark, request):
         """
         个性化定制mark处理方法
+        :param mark:
+        :param request: 当前作用域的request，用来获取需要注入的fixture
         :return:
         """
 
@@ -86,20 +156,103 @@ class Patcher(object):
         """
 
     @classmethod
-    def from_pytestconfig(cls, pytestconfig):
+    def config_dump(cls, mark_str, mark):
+        """
+        将config解析出来的mark序列化，还未求值的值保存其表达式，
+        无法序列化的mark保存原始配置，使用时重新解析
+        :param mark_str:
+        :param mark:
+        :return: dict
+        """
+        def dump(val):
+            if isinstance(val, Value):
+                return {"__value__": val.raw}
+            return val
+
+        data = {"args": [dump(arg) for arg in mark.args],
+                "kwargs": dict((key, dump(val))
+                               for key, val in mark.kwargs.items())}
+        try:
+            if json.loads(json.dumps(data)) == data:
+                return data
+        except (TypeError, ValueError):
+            pass
+        return {"raw": mark_str}
+
+    @classmethod
+    def config_load(cls, data):
+        """
+        反序列化config_dump的结果
+        :param data:
+        :return: Mark
+        """
+        def load(val):
+            if isinstance(val, dict) and list(val) == ["__value__"]:
+                return lazy_value(val["__value__"])
+            return val
+
+        if "raw" in data:
+            return cls.config_parse(data["raw"])
+        return Mark(cls.name, tuple(load(arg) for arg in data["args"]),
+                    dict((key, load(val))
+                         for key, val in data["kwargs"].items()))
+
+    @classmethod
+    def config_compile(cls, pytestconfig):
+        """
+        解析ini中的mock配置，返回可序列化的解析结果及解析出的mark，
+        未重新解析时mark为None，需要通过config_load获取。
+        :param pytestconfig:
+        :return: ({"digest": digest, "marks": [data]}, [Mark])
+        """
         mocks = pytestconfig.inicfg.get(cls.name)
+        if not mocks:
+            return None, list()
+
+        # 序列化格式随插件版本变化，旧版本缓存的结果不能使用
+        digest = hashlib.sha1(("%s/%s\n%s" % (
+            __version__, cls.config_format, mocks)).encode("utf-8")).hexdigest()
+        # xdist的worker直接使用主进程解析好的结果
+        workerinput = getattr(pytestconfig, "workerinput", None) or dict()
+        compiled = workerinput.get("apistellar_mocks", dict()).get(cls.name)
+        if compiled and compiled.get("digest") == digest:
+            return compiled, None
+        # 解析结果按配置内容的hash缓存在pytest的cache目录中，
+        # 配置不变时，再次启动无需重新解析。
+        cache = getattr(pytestconfig, "cache", None)
+        key = "apistellar/%s" % cls.name
+        cached = cache.get(key, None) if cache is not None else None
+        if cached and cached.get("digest") == digest:
+            return cached, None
+
         ms = list()
-        if mocks:
-            for m in mocks.strip().split("\n"):
-                if m.strip():
-                    mark = cls.config_parse(m.strip())
-                    if mark:
-                        ms.append(mark)
-        return cls(ms)
+        dumps = list()
+        for m in mocks.strip().split("\n"):
+            if m.strip():
+                mark = cls.config_parse(m.strip())
+                if mark:
+                    ms.append(mark)
+                    dumps.append(cls.config_dump(m.strip(), mark))
+        compiled = {"digest": digest, "marks": dumps}
+        if cache is not None:
+            cache.set(key, compiled)
+        return compiled, ms
+
+    @classmethod
+    def from_pytestconfig(cls, pytestconfig, **kwargs):
+        compiled, ms = cls.config_compile(pytestconfig)
+        if ms is None:
+            ms = [cls.config_load(data) for data in compiled["marks"]]
+        return cls([m for m in ms if m], **kwargs)
 
     @classmethod
     def from_request(cls, request, *args, **kwargs):
-        return cls(request.node.iter_markers(cls.name))
+        # 不在class中的单元测试，class作用域的request.node是function节点，
+        # 其上的mark属于function作用域，由mock处理
+        if request.scope == "class" and \
+                not isinstance(request.node, pytest.Class):
+            return cls(list(), **kwargs)
+        return cls(request.node.iter_markers(cls.name), **kwargs)
 
 
 class PropPatcher(Patcher):
@@ -108,46 +261,336 @@ class PropPatcher(Patcher):
     """
     name = "prop"
     order = 5
+    lazy = False
+    # 预热使用的线程数，为0时不预热
+    prewarm_workers = 0
+    # 最多缓存的mock计划数
+    max_plans = 1024
+    # apply_mark使用的关键字参数，不会传给ret_factory
+    options = ("fixture_inject", "fresh", "record", "cache", "cache_size")
+
+    def __init__(self, markers, monkey_patch=None):
+        super(PropPatcher, self).__init__(markers, monkey_patch)
+        # MarkerWrapper: 预热时工厂生成的值
+        self.prewarmed = dict()
+        # 是否只在当前上下文中应用mock
+        self.context = False
+        # 上下文mock安装的分发器的key及设置ContextVar返回的token
+        self.dispatched = list()
+        self.tokens = list()
+
+    def close(self):
+        super(PropPatcher, self).close()
+        finder.discard(self)
+        if self.tokens:
+            from .context import dispatcher, mocks
+            while self.tokens:
+                mocks.reset(self.tokens.pop())
+            while self.dispatched:
+                dispatcher.release(self.dispatched.pop())
+
+    def process(self, request):
+        # 懒加载模式下mock在模块导入后才应用，预热会提前导入模块，所以不预热
+        if self.prewarm_workers and not self.lazy:
+            self.markers = list(self.markers)
+            with profiler.timer("prewarm", scope=getattr(
+                    request, "scope", None)):
+                self.prewarm([mark for mark in self.markers if MarkerWrapper(
+                    mark) not in self.total_markers])
+        super(PropPatcher, self).process(request)
+
+    def prewarm(self, marks):
+        """
+        使用线程池并发解析mark的目标，并对非可调用属性的工厂求值，
+        所有mark预热完成后再统一报告错误。
+        :param marks:
+        :return:
+        """
+        from concurrent.futures import ThreadPoolExecutor
+
+        def warm(mark):
+            kwargs = dict((key, val) for key, val in mark.kwargs.items()
+                          if key not in self.options)
+            for mock in self.compile(mark, kwargs):
+                if not mock.callable and mock.ret_factory:
+                    self.prewarmed[MarkerWrapper(mark)] = mock.ret_factory()
+
+        errors = list()
+        with ThreadPoolExecutor(self.prewarm_workers) as executor:
+            for mark, future in [(mark, executor.submit(warm, mark))
+                                 for mark in marks]:
+                try:
+                    future.result()
+                except Exception as e:
+                    errors.append("%s: %s: %s" % (
+                        mark.args[0], e.__class__.__name__, e))
+        if errors:
+            raise RuntimeError("Failed to prewarm %d prop mock(s):\n%s" % (
+                len(errors), "\n".join(errors)))
 
     def guess_attr(self, prop, old, mock, func):
-        # 证明old是prop
+        # 证明old是mock的替身
         if hasattr(old, prop):
-            setattr(mock, prop, getattr(old, prop))
+            return getattr(old, prop)
         # 如果手动指定了，则使用手动指定的
         elif hasattr(mock, prop):
-            pass
+            return getattr(mock, prop)
         # 否则，自行判断
         else:
-            setattr(mock, prop, func(old))
+            return func(old)
+
+    @cache_classproperty
+    def plans(self):
+        """
+        mark编译后的mock计划，key为MarkerWrapper，value为Plan，
+        相同的mark再次被应用时直接重放已编译好的Prop。
+        计划持有mark及其ret_val和ret_factory，超过max_plans时淘汰最久未使用的。
+        :return:
+        :rtype: LRUCache
+        """
+        return LRUCache(self.max_plans)
+
+    def introspect(self, mock):
+        """
+        推断被mock属性的性质，并为其添加apistellar依赖注入需要的签名
+        :param mock:
+        :return: 推断后的Prop
+        """
+        old = getattr(mock.obj, mock.name, None)
+        changes = dict()
+        try:
+            from asyncio import iscoroutinefunction
+            changes["asyncable"] = self.guess_attr(
+                "asyncable", old, mock, iscoroutinefunction)
+        except ImportError:
+            changes["asyncable"] = False
+        changes["callable"] = self.guess_attr("callable", old, mock, callable)
+        # apistellar的依赖注入需要return 的signature
+        if changes["callable"]:
+            annotations = getattr(old, "__annotations__", None)
+            if annotations and "return" in annotations:
+                changes["signature"] = inspect.Signature(
+                    return_annotation=annotations["return"])
+                changes["annotations"] = {"return": annotations["return"]}
+        return mock.replace(**changes)
+
+    def compile(self, mark, kwargs):
+        """
+        将mark编译成Prop，优先使用已缓存的计划
+        :param mark:
+        :param kwargs:
+        :return:
+        """
+        mark_wrapper = MarkerWrapper(mark)
+        plan = self.plans.get(mark_wrapper)
+        if plan is not missing and plan.valid:
+            for mock in plan.replay():
+                yield mock
+            return
+
+        # ini中配置的值在第一次应用时才求值
+        if isinstance(kwargs.get("ret_val"), Value):
+            kwargs["ret_val"] = resolve(kwargs["ret_val"])
+        props = list()
+        for mock in parse(mark.args[0], mark.args[1:], kwargs=kwargs):
+            props.append(self.introspect(mock))
+        plan = self.plans[mark_wrapper] = Plan(mark.args[0], props)
+        for mock in plan.replay():
+            yield mock
+
+    def process_mark(self, mark, request):
+        # 懒加载模式下，被mock对象所属模块导入完成后才应用mock
+        if self.lazy and finder.defer(
+                mark.args[0].rpartition(".")[0], self,
+                partial(self.apply_mark, mark, request)):
+            return
+        self.apply_mark(mark, request)
+
+    @cache_classproperty
+    def injectables(self):
+        """
+        工厂签名索引，key为工厂，value为工厂可以接收的参数名，
+        注入fixture时只请求这些参数对应的fixture。
+        :return:
+        :rtype: dict
+        """
+        return dict()
 
-    def process_mark(self, mark, fixture_kwargs):
+    def injectable(self, factory, request):
+        """
+        返回factory需要注入的fixture名称
+        :param factory:
+        :param request:
+        :return: tuple
+        """
+        try:
+            names = self.injectables.get(factory)
+        except TypeError:
+            names = None
+        if names is None:
+            try:
+                params = inspect.signature(factory).parameters.values()
+            except (TypeError, ValueError):
+                params = list()
+            names = tuple(p.name for p in params if p.kind in (
+                p.POSITIONAL_OR_KEYWORD, p.KEYWORD_ONLY))
+            try:
+                self.injectables[factory] = names
+            except TypeError:
+                pass
+
+        # 单元测试依赖的所有fixture，不论是否已经创建，第一次调用工厂时才获取
+        fixture_defs = request._arg2fixturedefs
+        # 当前请求作用域适用于该fixture的作用域
+        return tuple(name for name in names if fixture_defs.get(name) and
+                     namespace[request.scope] <= namespace[
+                         fixture_defs[name][-1].scope])
+
+    def apply_mark(self, mark, request):
+        prewarmed = self.prewarmed.pop(MarkerWrapper(mark), missing)
         kwargs = mark.kwargs.copy()
         # 是否往factory中注入fixture
         fixture_inject = kwargs.pop("fixture_inject", False)
-        for mock in parse(mark.args[0], mark.args[1:], kwargs=kwargs):
-            if mock.ret_factory and fixture_kwargs and fixture_inject:
-                mock.ret_factory = partial(mock.ret_factory, **fixture_kwargs)
+        kwargs.pop("fresh", None)
+        # 是否记录调用，值为保留的调用次数
+        record = kwargs.pop("record", None)
+        # ret_factory返回值的缓存作用域
+        cache = kwargs.pop("cache", "call")
+        cache_size = kwargs.pop("cache_size", None)
+        if cache != "call" and cache not in namespace:
+            raise ValueError("Invalid cache scope: %r, must be one of %s." % (
+                cache, ", ".join(["call"] + list(namespace))))
+        for mock in self.compile(mark, kwargs):
+            if prewarmed is not missing and not mock.callable and \
+                    mock.ret_factory:
+                mock = mock.replace(ret_factory=None, ret_val=prewarmed)
+            injected = False
+            if mock.ret_factory and request is not None and fixture_inject:
+                names = self.injectable(mock.ret_factory, request)
+                if names:
+                    injected = True
+                    mock = mock.replace(ret_factory=FixtureInjector(
+                        mock.ret_factory, request, names))
+            if mock.ret_factory and cache != "call":
+                # 注入的fixture每次mock都可能不同，缓存只在本次mock内有效
+                if injected:
+                    factory_cache = LRUCache(cache_size)
+                else:
+                    factory_cache = self.factory_cache(
+                        mark, cache, cache_size, request)
+                mock = mock.replace(cache=factory_cache)
+            if record and mock.callable:
+                recorder = CallRecorder(record)
+                mock = mock.replace(recorder=recorder)
+                # 随mock一起撤销
+                self.monkey_patch.setitem(
+                    self.recorders, mark.args[0], recorder)
+            obj, name, value = mock
+            if self.context and self.dispatch(obj, name, value):
+                continue
+            self.monkey_patch.setattr(obj, name, value, raising=False)
+
+    def dispatch(self, obj, name, value):
+        """
+        在当前上下文中应用mock，不能分发的属性返回False，需要全局mock
+        :param obj:
+        :param name:
+        :param value:
+        :return:
+        """
+        from .context import dispatcher, mocks
+        key = dispatcher.acquire(obj, name, value)
+        if key is None:
+            return False
+        self.dispatched.append(key)
+        values = dict(mocks.get() or dict())
+        values[key] = value
+        self.tokens.append(mocks.set(values))
+        return True
 
-            try:
-                old = getattr(mock.obj, mock.name, None)
-                try:
-                    from asyncio import iscoroutinefunction
-                    self.guess_attr("asyncable", old, mock, iscoroutinefunction)
-                except ImportError:
-                    mock.asyncable = False
-                self.guess_attr("callable", old, mock, callable)
-                # apistellar的依赖注入需要return 的signature
-                if mock.callable:
-                    if getattr(old, "__annotations__", None):
-                        if "return" in old.__annotations__:
-                            mock.__signature__ = inspect.Signature(
-                                return_annotation=old.__annotations__["return"])
-                            mock.__annotations__ = {
-                                "return": old.__annotations__["return"]}
-            except AttributeError:
-                raise RuntimeError("{} has not attr: {}".format(
-                    mock.obj, mock.name))
-            self.monkey_patch.setattr(*mock, raising=False)
+    @cache_classproperty
+    def caches(self):
+        """
+        ret_factory返回值的缓存，key为(MarkerWrapper, 缓存作用域对应的节点)，
+        value为LRUCache，在节点teardown时清空并释放。
+        :return:
+        :rtype: dict
+        """
+        return dict()
+
+    def factory_cache(self, mark, scope, size, request):
+        """
+        返回mark在scope作用域内共享的缓存
+        :param mark:
+        :param scope: 缓存作用域
+        :param size: 缓存大小
+        :param request:
+        :return: LRUCache
+        """
+        if request is None:
+            return LRUCache(size)
+        if namespace[scope] < namespace[request.scope]:
+            raise ValueError(
+                "Cache scope %s of %s is narrower than its mark scope %s." % (
+                    scope, mark.args[0], request.scope))
+
+        if scope == request.scope:
+            node = request.node
+        elif scope == "session":
+            node = request.session
+        else:
+            node = request.node.getparent(getattr(pytest, scope.title())) \
+                   or request.node
+        key = (MarkerWrapper(mark), node)
+        cache = self.caches.get(key)
+        if cache is None:
+            cache = self.caches[key] = LRUCache(size)
+
+            def release():
+                # mock_diff模式下替身可能被之后的单元测试复用，所以需要清空
+                cache.clear()
+                self.caches.pop(key, None)
+            node.addfinalizer(release)
+        return cache
+
+    @cache_classproperty
+    def recorders(self):
+        """
+        当前生效的调用记录，key为被mock的属性路径，value为CallRecorder
+        :return:
+        :rtype: dict
+        """
+        return dict()
+
+    @classmethod
+    def from_pytestconfig(cls, pytestconfig, **kwargs):
+        patcher = super(PropPatcher, cls).from_pytestconfig(
+            pytestconfig, **kwargs)
+        patcher.lazy = pytestconfig.getini("lazy_prop")
+        patcher.prewarm_workers = int(
+            pytestconfig.getini("prewarm_workers") or 0)
+        return patcher
+
+    @classmethod
+    def from_request(cls, request, *args, **kwargs):
+        patcher = super(PropPatcher, cls).from_request(
+            request, *args, **kwargs)
+        # 只有function作用域的mock在上下文中应用
+        patcher.context = request.scope == "function" and \
+            request.config.getini("context_prop") and \
+            not cls.threaded_server(request)
+        return patcher
+
+    @staticmethod
+    def threaded_server(request):
+        """
+        单元测试是否使用了在子线程中运行的测试server，
+        ContextVar的值在其它线程中不可见，server中看不到上下文中的mock，需要全局应用
+        :param request:
+        :return:
+        """
+        return "server" in request.fixturenames and \
+            not int(request.config.getini("server_workers") or 0)
 
     @classmethod
     def config_parse(cls, mark):
@@ -156,7 +599,7 @@ class PropPatcher(Patcher):
             kwargs = {"ret_factory": ret_factory}
         else:
             mark, ret_val = mark.split("=", 1)
-            kwargs = {"ret_val": guess(ret_val)}
+            kwargs = {"ret_val": lazy_value(ret_val)}
 
         return Mark(cls.name, tuple([mark]), kwargs)
 
@@ -169,19 +612,20 @@ class ItemPatcher(Patcher):
     order = 4
     mark_config_regex = re.compile(r"(.+?)\[(.+?)\]\s*=\s*?(.+)")
 
-    def process_mark(self, mark, fixture_kwargs):
+    def process_mark(self, mark, request):
         for key, val in mark.kwargs.items():
             item = mark.args[0]
             if isinstance(item, str):
                 item = load(item)
-            self.monkey_patch.setitem(item, key, val)
+            self.monkey_patch.setitem(item, key, resolve(val))
 
     @classmethod
     def config_parse(cls, mark_str):
         mth = cls.mark_config_regex.search(mark_str)
         if mth:
             prop_name, key, val = mth.groups()
-            return Mark(cls.name, tuple([prop_name]), {eval(key): guess(val)})
+            return Mark(cls.name, tuple([prop_name]),
+                        {ast.literal_eval(key): lazy_value(val)})
 
 
 class EnvPatcher(Patcher):
@@ -191,15 +635,15 @@ class EnvPatcher(Patcher):
     name = "env"
     order = 3
 
-    def process_mark(self, mark, fixture_kwargs):
+    def process_mark(self, mark, request):
         prepend = mark.kwargs.pop("prepend", None)
         for key, val in mark.kwargs.items():
-            self.monkey_patch.setenv(key, val, prepend)
+            self.monkey_patch.setenv(key, resolve(val), prepend)
 
     @classmethod
     def config_parse(cls, mark_str):
         key, val = mark_str.split("=", 1)
-        return Mark(cls.name, tuple(), {key: guess(val)})
+        return Mark(cls.name, tuple(), {key: lazy_value(val)})
 
 
 class PathPatcher(Patcher):
@@ -209,12 +653,12 @@ class PathPatcher(Patcher):
     name = "path"
     order = 1
 
-    def process_mark(self, mark, fixture_kwargs):
-        self.monkey_patch.chdir(mark.args[0])
+    def process_mark(self, mark, request):
+        self.monkey_patch.chdir(resolve(mark.args[0]))
 
     @classmethod
     def config_parse(cls, mark_str):
-        return Mark(cls.name, tuple([guess(mark_str)]), dict())
+        return Mark(cls.name, tuple([lazy_value(mark_str)]), dict())
 
 
 class SysPathPatcher(PathPatcher):
@@ -224,21 +668,143 @@ class SysPathPatcher(PathPatcher):
     name = "syspath"
     order = 2
 
-    def process_mark(self, mark, fixture_kwargs):
-        self.monkey_patch.syspath_prepend(os.path.abspath(mark.args[0]))
+    def process_mark(self, mark, request):
+        self.monkey_patch.syspath_prepend(
+            os.path.abspath(resolve(mark.args[0])))
+
+
+def compile_config(pytestconfig):
+    """
+    解析ini中所有的mock配置，返回可序列化的解析结果，用于传给xdist的worker
+    :param pytestconfig:
+    :return:
+    """
+    compiled = dict()
+    for patcher in find_children(Patcher):
+        data = patcher.config_compile(pytestconfig)[0]
+        if data:
+            compiled[patcher.name] = data
+    return compiled
 
 
 def process(fromobj, request=None, load_from="request",
             patchers=sorted(find_children(Patcher), key=lambda x: x.order)):
-    if not patchers:
+    # 同一作用域的所有patcher共用一个MonkeyPatch作为撤销日志，
+    # 按order依次应用，退出时一次性逆序撤销。
+    monkey_patch = MonkeyPatch()
+    instances = list()
+    scope = request.scope
+    try:
+        with profiler.scoped(scope):
+            for patcher in patchers:
+                patcher = getattr(patcher, "from_%s" % load_from)(
+                    fromobj, monkey_patch=monkey_patch)
+                instances.append(patcher)
+                patcher.process(request)
         yield
+    finally:
+        for patcher in reversed(instances):
+            patcher.close()
+        with profiler.timer("undo", scope=scope):
+            monkey_patch.undo()
 
-    patcher = patchers[0]
-    with getattr(patcher, "from_%s" % load_from)(fromobj) as patcher:
-        patcher.process(request)
-        # 使用一个变量来指向生成器，防止在整个函数返回之前被gc
-        gen = process(fromobj, request, load_from, patchers[1:])
-        yield next(gen)
+
+class MockStack(object):
+    """
+    function作用域的mock栈，相邻的单元测试function级别的mark相同时保留已应用的mock，
+    只撤销发生变化的部分并应用新增的部分。
+    """
+    def __init__(self):
+        # [(MarkerWrapper, patcher)]，每个patcher使用独立的MonkeyPatch
+        self.entries = list()
+        # 注册了撤销的父节点(class或module)
+        self.parent = None
+
+    @staticmethod
+    def fresh(patcher, mark):
+        """
+        fresh=True、注入了fixture、记录调用或缓存作用域为function的prop mark
+        每个单元测试都需要重新应用
+        :param patcher:
+        :param mark:
+        :return:
+        """
+        return patcher.name == "prop" and bool(
+            mark.kwargs.get("fresh") or mark.kwargs.get("fixture_inject") or
+            mark.kwargs.get("record") or mark.kwargs.get("cache") == "function")
+
+    @staticmethod
+    def same(mark, other):
+        """
+        不同单元测试上的mark不是同一个对象，name, args, kwargs相同即认为是相同的mock
+        :param mark:
+        :param other:
+        :return:
+        """
+        if mark is other:
+            return True
+        try:
+            return bool(mark == other)
+        except Exception:
+            return False
+
+    def apply(self, request, patchers=sorted(
+            find_children(Patcher), key=lambda x: x.order)):
+        marks = list()
+        for patcher in patchers:
+            for mark in request.node.iter_markers(patcher.name):
+                mark_wrapper = MarkerWrapper(mark)
+                if mark_wrapper not in patcher.total_markers:
+                    marks.append((patcher, mark_wrapper))
+
+        # 保留相同的前缀，后面的mock可能覆盖了前面的，所以从第一个不同处开始撤销
+        index = 0
+        for (mark_wrapper, patcher), (cls, new_wrapper) in zip(
+                self.entries, marks):
+            if type(patcher) is not cls or not self.same(
+                    mark_wrapper.marker, new_wrapper.marker) or \
+                    self.fresh(cls, mark_wrapper.marker):
+                break
+            index += 1
+        self.undo(index)
+
+        # 下一个单元测试被跳过时mock fixture不会执行，无法在其teardown中撤销，
+        # 所以在父节点teardown时撤销，保证先于class_mock和module_mock撤销
+        parent = getattr(request.node, "parent", None)
+        if parent is not None and parent is not self.parent:
+            self.parent = parent
+            parent.addfinalizer(self.release)
+
+        with profiler.scoped(request.scope):
+            for cls, mark_wrapper in marks[index:]:
+                patcher = cls([mark_wrapper.marker], monkey_patch=MonkeyPatch())
+                self.entries.append((mark_wrapper, patcher))
+                with profiler.timer(
+                        "process_mark", patcher.describe(mark_wrapper.marker)):
+                    patcher.process_mark(mark_wrapper.marker, request)
+
+    def release(self):
+        """
+        父节点teardown时撤销所有mock
+        :return:
+        """
+        self.parent = None
+        self.undo()
+
+    def undo(self, index=0):
+        """
+        逆序撤销index之后的mock
+        :param index:
+        :return:
+        """
+        while len(self.entries) > index:
+            mark_wrapper, patcher = self.entries.pop()
+            patcher.close()
+            with profiler.timer("undo", scope="function"):
+                patcher.monkey_patch.undo()
+
+
+stack = MockStack()
 
 
 def build(scope, load_from="request"):
@@ -1,12 +1,74 @@
 # -*- coding:utf-8 -*-
 import os
-import time
 import pytest
 
 from functools import partial
 
-from .utils import create_server
-from .patcher import build, process
+from .utils import ServerPool, create_app
+from .profiler import profiler
+from .patcher import build, process, compile_config, stack, PropPatcher
+
+
+def pytest_addoption(parser):
+    group = parser.getgroup("apistellar")
+    group.addoption("--apistellar-profile", action="store_true", default=False,
+                    help="统计插件自身各阶段的耗时，并在结束时输出报告")
+    group.addoption("--apistellar-profile-json", default=None, metavar="path",
+                    help="将插件耗时统计结果保存为json文件")
+    parser.addini("lazy_prop", type="bool", default=False,
+                  help="session作用域的prop mock在被mock对象所属模块导入后才生效")
+    parser.addini("server_uds", type="bool", default=False,
+                  help="测试server使用unix domain socket监听")
+    parser.addini("mock_diff", type="bool", default=False,
+                  help="相邻单元测试function级别的mark相同时，保留已应用的mock")
+    parser.addini("prewarm_workers", default="0",
+                  help="使用多少个线程并发预热session作用域的prop mock，0为不预热")
+    parser.addini("context_prop", type="bool", default=False,
+                  help="function作用域的prop mock只在当前上下文(contextvars)中生效")
+    parser.addini("server_workers", default="0",
+                  help="测试server使用的子进程数，0为在当前进程的子线程中运行")
+    parser.addini("load_report", default="",
+                  help="load fixture的压测结果保存的json文件")
+
+
+def pytest_configure(config):
+    profiler.enabled = bool(config.getoption("apistellar_profile") or
+                            config.getoption("apistellar_profile_json"))
+    config._apistellar_load_reports = list()
+
+
+def pytest_unconfigure(config):
+    filename = config.getoption("apistellar_profile_json")
+    if filename:
+        profiler.dump(filename)
+    profiler.enabled = False
+    filename = config.getini("load_report")
+    reports = getattr(config, "_apistellar_load_reports", None)
+    if filename and reports:
+        from .loadgen import dump_reports
+        dump_reports(filename, reports)
+
+
+@pytest.hookimpl(tryfirst=True)
+def pytest_runtest_teardown(item, nextitem):
+    # 供mock fixture在teardown时判断下一个单元测试能否复用当前的mock
+    item._apistellar_nextitem = nextitem
+
+
+@pytest.hookimpl(tryfirst=True)
+def pytest_sessionfinish(session):
+    stack.undo()
+
+
+@pytest.hookimpl(optionalhook=True)
+def pytest_configure_node(node):
+    """
+    xdist主进程只解析一次ini中的mock配置，解析结果传给所有worker
+    """
+    config = node.config
+    if not hasattr(config, "_apistellar_mocks"):
+        config._apistellar_mocks = compile_config(config)
+    node.workerinput["apistellar_mocks"] = config._apistellar_mocks
 
 
 @pytest.fixture(scope="session")
@@ -15,23 +77,80 @@ def join_root_dir(pytestconfig):
         pytestconfig.getoption("rootdir") or "."))
 
 
+def pytest_terminal_summary(terminalreporter, config):
+    if profiler.enabled and profiler.stats:
+        terminalreporter.section("apistellar profile")
+        profiler.report(terminalreporter.write_line)
+    pool = getattr(config, "_apistellar_server_pool", None)
+    if pool and pool.timings:
+        terminalreporter.section("apistellar server")
+        for path, startup_time, shutdown_time in pool.timings:
+            terminalreporter.write_line(
+                "%s: startup %.3fs, shutdown %.3fs" % (
+                    path, startup_time, shutdown_time))
+
+
+@pytest.fixture(scope="session")
+def server_pool(pytestconfig):
+    """
+    session内共享的server池，同一应用目录的server只启动一次，session结束时统一关闭
+    """
+    pool = pytestconfig._apistellar_server_pool = ServerPool(
+        pytestconfig.getini("server_uds"),
+        int(pytestconfig.getini("server_workers") or 0))
+    try:
+        yield pool
+    finally:
+        pool.close()
+
+
 @pytest.fixture(scope="module")
-def server(request):
+def server(request, server_pool):
     old_path = os.getcwd()
-    loop = None
-    server = None
+    # 子进程只继承启动时的环境变量等，需要保证session作用域的mock已经生效
+    if server_pool.workers and "session_mock" in request.fixturenames:
+        request.getfixturevalue("session_mock")
     try:
         path = os.path.dirname(request.module.__file__)
-        loop, server = create_server(path)
-        yield server.config
+        config = server_pool.get(path).config
+        # app只在创建时切换到应用目录，复用已启动的server或在子进程中运行时，
+        # 当前进程不会切换，所以每个模块都需要切换
+        os.chdir(path)
+        yield config
+    finally:
+        os.chdir(old_path)
+
+
+@pytest.fixture(name="load")
+def load_generator(request, server):
+    """
+    对server发起并发请求，统计延迟分布及吞吐量，返回LoadResult，
+    结果会保存到load_report指定的json文件中
+    """
+    from .loadgen import LoadGenerator
+
+    def on_result(result):
+        report = result.to_dict()
+        report["test"] = request.node.nodeid
+        request.config._apistellar_load_reports.append(report)
+
+    return LoadGenerator(server, on_result)
+
+
+@pytest.fixture(scope="module")
+def asgi_client(request):
+    """
+    不经过socket，在测试自身的事件循环中直接通过ASGI接口调用app，
+    请求接口与aiohttp.ClientSession兼容
+    """
+    from .client import ASGIClient
+
+    old_path = os.getcwd()
+    try:
+        path = os.path.dirname(request.module.__file__)
+        yield ASGIClient(create_app(path))
     finally:
         os.chdir(old_path)
-        if server:
-            server.should_exit = True
-            # 等待tick退出
-            time.sleep(1)
-        if loop:
-            loop.stop()
 
 
 session_mock = build("session", "pytestconfig")
@@ -42,8 +161,31 @@ class_mock = build("class")
 @pytest.fixture
 def mock(request, session_mock, module_mock, class_mock):
     """封装monkey patch实现mock env和prop"""
-    # 这里不能连着写，因为连着写生成器会被马上回收，
-    # 回收后会马上调用上下文对象的__exit__，导致触发monkey.undo
-    gen = process(request, request)
-    yield next(gen)
+    if request.config.getini("mock_diff"):
+        try:
+            stack.apply(request)
+        except BaseException:
+            # 出错时fixture不会teardown，已应用的mock需要在这里撤销，否则会影响之后的单元测试
+            stack.undo()
+            raise
+        yield
+        nextitem = getattr(request.node, "_apistellar_nextitem", None)
+        # 下一个单元测试属于同一个class或module且使用mock时，保留当前的mock，
+        # 否则需要在class_mock和module_mock撤销之前撤销
+        if nextitem is None or nextitem.parent is not request.node.parent \
+                or "mock" not in nextitem.fixturenames:
+            stack.undo()
+    else:
+        # 这里不能连着写，因为连着写生成器会被马上回收，
+        # 回收后会马上调用上下文对象的__exit__，导致触发monkey.undo
+        gen = process(request, request)
+        yield next(gen)
 
+
+@pytest.fixture
+def mock_calls(mock):
+    """
+    返回当前生效的调用记录，key为被mock的属性路径，value为CallRecorder，
+    需要在prop mark中指定record=N
+    """
+    return PropPatcher.recorders
@@ -0,0 +1,141 @@
+# -*- coding:utf-8 -*-
+import json
+import time
+import threading
+
+from contextlib import contextmanager
+
+
+class Timer(object):
+    """
+    统计一段代码的耗时
+    """
+    def __init__(self, profiler, phase, scope, target):
+        self.profiler = profiler
+        self.phase = phase
+        self.scope = scope
+        self.target = target
+        self.start = None
+
+    def __enter__(self):
+        # 单调时钟，不受系统时间调整的影响
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.profiler.record(self.phase, time.perf_counter() - self.start,
+                             self.scope, self.target)
+
+
+class NoopTimer(object):
+    """
+    关闭统计时使用的计时器，不做任何事情
+    """
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        pass
+
+
+class Profiler(object):
+    """
+    统计插件自身各阶段(导入、解析、求值、mock、撤销、server启停)的耗时，
+    按阶段、作用域及被mock的对象分别汇总。
+    """
+    noop = NoopTimer()
+
+    def __init__(self):
+        self.enabled = False
+        # 当前正在处理的作用域
+        self.scope = None
+        # (phase, scope, target): [count, total, max]
+        self.stats = dict()
+        # 预热时会在多个线程中统计
+        self.lock = threading.Lock()
+
+    def timer(self, phase, target=None, scope=None):
+        """
+        :param phase: 阶段
+        :param target: 被mock的对象等
+        :param scope: 不指定时使用当前正在处理的作用域
+        :return:
+        """
+        if not self.enabled:
+            return self.noop
+        return Timer(self, phase, scope or self.scope, target)
+
+    @contextmanager
+    def scoped(self, scope):
+        """
+        with中未指定作用域的耗时都归属于scope，退出时(包括出错时)恢复之前的作用域
+        :param scope:
+        :return:
+        """
+        old, self.scope = self.scope, scope
+        try:
+            yield
+        finally:
+            self.scope = old
+
+    def record(self, phase, elapsed, scope=None, target=None):
+        key = (phase, scope, target)
+        with self.lock:
+            stat = self.stats.get(key)
+            if stat is None:
+                stat = self.stats[key] = [0, 0.0, 0.0]
+            stat[0] += 1
+            stat[1] += elapsed
+            stat[2] = max(stat[2], elapsed)
+
+    def summary(self, key_func):
+        """
+        按key_func汇总
+        :param key_func: 接收(phase, scope, target)返回汇总的key
+        :return: {key: [count, total, max]}
+        """
+        result = dict()
+        for key, (count, total, max_time) in self.stats.items():
+            stat = result.setdefault(key_func(*key), [0, 0.0, 0.0])
+            stat[0] += count
+            stat[1] += total
+            stat[2] = max(stat[2], max_time)
+        return result
+
+    def report(self, write_line, top=10):
+        """
+        输出统计报告
+        :param write_line:
+        :param top: 输出最慢的前top个对象
+        :return:
+        """
+        write_line("%-20s %8s %10s %10s" % ("phase", "count", "total(s)", "max(s)"))
+        for phase, (count, total, max_time) in sorted(
+                self.summary(lambda p, s, t: p).items(),
+                key=lambda x: -x[1][1]):
+            write_line("%-20s %8d %10.4f %10.4f" % (phase, count, total, max_time))
+
+        write_line("")
+        write_line("%-20s %-10s %8s %10s" % ("phase", "scope", "count", "total(s)"))
+        for (phase, scope), (count, total, max_time) in sorted(
+                self.summary(lambda p, s, t: (p, s or "-")).items()):
+            write_line("%-20s %-10s %8d %10.4f" % (phase, scope, count, total))
+
+        write_line("")
+        write_line("slowest %d targets:" % top)
+        targets = self.summary(lambda p, s, t: (p, t))
+        for (phase, target), (count, total, max_time) in sorted(
+                ((k, v) for k, v in targets.items() if k[1] is not None),
+                key=lambda x: -x[1][1])[:top]:
+            write_line("%10.4fs %6d %-14s %s" % (total, count, phase, target))
+
+    def dump(self, filename):
+        with open(filename, "w") as f:
+            json.dump([{
+                "phase": phase, "scope": scope, "target": target,
+                "count": count, "total": total, "max": max_time}
+                for (phase, scope, target), (count, total, max_time)
+                in self.stats.items()], f, indent=2)
+
+
+profiler = Profiler()
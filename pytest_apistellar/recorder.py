@@ -0,0 +1,74 @@
+# -*- coding:utf-8 -*-
+import time
+
+from itertools import count
+from operator import attrgetter
+from collections import namedtuple
+from six.moves._thread import get_ident
+
+Call = namedtuple("Call", "index args kwargs timestamp thread")
+
+
+class CallRecorder(object):
+    """
+    记录mock的调用情况，使用预分配的环形缓冲区，只保留最近size次调用。
+    写入时只有一次计数器自增和一次列表赋值，都是原子操作，不需要加锁，
+    可以在测试server所在的线程中被高频调用，内存占用不会增长。
+    """
+    default_size = 100
+
+    def __init__(self, size):
+        """
+        :param size: 缓冲区大小，为True时使用默认大小
+        """
+        self.size = self.default_size if size is True else int(size)
+        if self.size <= 0:
+            raise ValueError("record size must be positive: %r" % size)
+        self.buffer = [None] * self.size
+        self.counter = count()
+
+    def append(self, args, kwargs):
+        index = next(self.counter)
+        self.buffer[index % self.size] = Call(
+            index, args, kwargs, time.time(), get_ident())
+
+    @property
+    def calls(self):
+        """
+        按调用顺序返回缓冲区中保留的调用记录
+        :return:
+        """
+        return sorted([call for call in list(self.buffer) if call is not None],
+                      key=attrgetter("index"))
+
+    @property
+    def call_count(self):
+        """
+        总调用次数，包括已经被覆盖的调用
+        :return:
+        """
+        return max([call.index + 1 for call in list(self.buffer)
+                    if call is not None] or [0])
+
+    @property
+    def called(self):
+        return any(call is not None for call in self.buffer)
+
+    @property
+    def last_call(self):
+        calls = self.calls
+        return calls[-1] if calls else None
+
+    def clear(self):
+        self.buffer[:] = [None] * self.size
+        self.counter = count()
+
+    def __iter__(self):
+        return iter(self.calls)
+
+    def __len__(self):
+        return len(self.calls)
+
+    def __repr__(self):
+        return "<CallRecorder(size=%s call_count=%s)>" % (
+            self.size, self.call_count)
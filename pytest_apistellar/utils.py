@@ -1,66 +1,424 @@
 # -*- coding:utf-8 -*-
-import re
+import os
+import ast
+import sys
 import time
+import shutil
 import socket
+import tempfile
 import warnings
 import threading
 
+from copy import copy, deepcopy
+from six.moves import builtins
+from collections import OrderedDict
 from functools import wraps, reduce
+from importlib import import_module
 
+from .profiler import profiler
 
-def run_server(path, container, port=None):
+missing = object()
+
+
+def create_app(path):
     """
-    创建一个简单的server用来测试
-    :param path:
-    :param port:
+    创建测试用的apistellar app
+    :param path: 应用目录
     :return:
     """
     try:
-        import asyncio
         from apistellar import Application
-        from uvicorn.main import Server, Config
+    except ImportError:
+        warnings.warn("Python3.6+: apistellar required. ")
+        raise
+    return Application("test", current_dir=path)
 
-        class TestServer(Server):
-            # 子线程无法注册信号
-            def install_signal_handlers(self):
-                pass
 
+def run_server(path, container, ready, port=None, uds=None, sock=None):
+    """
+    创建一个简单的server用来测试
+    :param path:
+    :param container: 用来将server传回主线程
+    :param ready: server开始监听后被设置的Event
+    :param port:
+    :param uds: 指定后使用unix domain socket监听
+    :param sock: 已绑定的监听socket，不指定时根据port或uds绑定
+    :return:
+    """
+    try:
+        from .compact import get_test_server
     except ImportError:
         warnings.warn("Python3.6+: apistellar required. ")
         raise
-    app = Application("test", current_dir=path)
-    port = port or free_port()
-    server = TestServer(Config(app, host="127.0.0.1", port=port, loop="asyncio"))
-    container.append(None)
-    container.append(server)
-    server.run()
+    app = create_app(path)
+    sock = sock or bind_socket(port, uds)
+    try:
+        server = get_test_server(ready)(server_config(app, sock))
+        container.append(server)
+        # 直接使用已监听的socket，uvicorn不再重复绑定
+        server.run(sockets=[sock])
+    finally:
+        sock.close()
+
+
+def server_config(app, sock):
+    """
+    返回使用已绑定的sock监听的server配置
+    :param app:
+    :param sock:
+    :return:
+    """
+    from uvicorn.main import Config
+    if sock.family == socket.AF_INET:
+        return Config(app, host="127.0.0.1",
+                      port=sock.getsockname()[1], loop="asyncio")
+    return Config(app, uds=sock.getsockname(), loop="asyncio")
+
+
+def serve_worker(path, sock, ready):
+    """
+    在子进程中运行server，所有子进程共享父进程绑定的监听socket
+    :param path:
+    :param sock:
+    :param ready: server开始监听后被设置的Event
+    :return:
+    """
+    from .compact import get_test_server
+    config = server_config(create_app(path), sock)
+    # 子进程需要响应terminate发出的SIGTERM，正常关闭
+    get_test_server(ready, signals=True)(config).run(sockets=[sock])
+
+
+class ProcessServer(object):
+    """
+    在多个子进程中运行的server
+    """
+    def __init__(self, config, processes):
+        """
+        :param config: server的配置，只用来获取监听的地址
+        :param processes: 运行server的子进程
+        """
+        self.config = config
+        self.processes = processes
+        self.startup_time = None
+        self.shutdown_time = None
+
+
+def create_process_server(path, workers, timeout=10, uds=None):
+    """
+    在workers个子进程中启动server，等待所有子进程开始监听后返回。
+    子进程使用spawn方式启动，启动时的环境变量、sys.path和工作目录与当前进程相同，
+    prop和item的mock不会在子进程中生效。
+    :param path:
+    :param workers: 子进程个数
+    :param timeout:
+    :param uds: 指定后使用unix domain socket监听
+    :return: ProcessServer
+    """
+    import multiprocessing
+    context = multiprocessing.get_context("spawn")
+    sock = bind_socket(uds=uds)
+    server = ProcessServer(server_config(None, sock), list())
+    start = time.time()
+    try:
+        with profiler.timer("server_startup", path):
+            events = list()
+            for _ in range(workers):
+                ready = context.Event()
+                process = context.Process(
+                    target=serve_worker, args=(path, sock, ready))
+                process.daemon = True
+                process.start()
+                server.processes.append(process)
+                events.append(ready)
+
+            for process, ready in zip(server.processes, events):
+                while not ready.wait(0.05):
+                    if not process.is_alive():
+                        raise RuntimeError(
+                            "server子进程启动失败，exitcode: %s！" % process.exitcode)
+                    if time.time() - start > timeout:
+                        raise RuntimeError("server子进程启动超时！")
+    except BaseException:
+        stop_process_server(server)
+        raise
+    finally:
+        # 子进程已经持有监听socket，当前进程不再需要
+        sock.close()
+    server.startup_time = time.time() - start
+    return server
+
+
+def stop_process_server(server, timeout=5):
+    """
+    通知所有子进程退出并等待其结束
+    :param server:
+    :param timeout:
+    :return:
+    """
+    start = time.time()
+    for process in server.processes:
+        if process.is_alive():
+            process.terminate()
+    for process in server.processes:
+        process.join(max(timeout - (time.time() - start), 0))
+        if process.is_alive():
+            process.kill()
+            process.join()
+    server.shutdown_time = time.time() - start
 
 
-def create_server(path):
+def create_server(path, timeout=10, uds=None):
+    """
+    在子线程中启动server，等待其开始监听后返回
+    :param path:
+    :param timeout:
+    :param uds: 指定后使用unix domain socket监听
+    :return: (thread, server)
+    """
     container = []
-    th = threading.Thread(target=run_server, args=(path, container))
+    errors = []
+    ready = threading.Event()
+    # 在主线程中绑定，端口冲突等错误直接抛出，绑定后的端口号即为server的端口
+    sock = bind_socket(uds=uds)
+
+    def target():
+        try:
+            run_server(path, container, ready, sock=sock)
+        except BaseException as e:
+            errors.append(e)
+        finally:
+            # 启动失败时及时唤醒主线程
+            ready.set()
+
+    start = time.time()
+    th = threading.Thread(target=target)
     th.setDaemon(True)
-    th.start()
-    # 等待10秒
-    for i in range(100):
-        time.sleep(0.1)
-        if len(container) == 2:
-            break
+    with profiler.timer("server_startup", path):
+        th.start()
+        if not ready.wait(timeout):
+            # 通知可能已经创建的server退出，并关闭监听socket
+            if container:
+                container[0].should_exit = True
+            sock.close()
+            raise RuntimeError("子线程启动超时！")
+    if errors:
+        raise errors[0]
+    server = container[0]
+    if server.should_exit:
+        raise RuntimeError("server启动失败！")
+    server.startup_time = time.time() - start
+    return th, server
+
+
+def stop_server(th, server, timeout=5):
+    """
+    通知server退出并等待子线程结束
+    :param th:
+    :param server:
+    :param timeout:
+    :return:
+    """
+    start = time.time()
+    server.should_exit = True
+    th.join(timeout)
+    if th.is_alive():
+        # 还有连接未关闭，强制退出
+        server.force_exit = True
+        th.join(timeout)
+    server.shutdown_time = time.time() - start
+
+
+class ServerPool(object):
+    """
+    按应用目录缓存测试server，同一目录的server在整个session中只启动一次
+    """
+    def __init__(self, uds=False, workers=0):
+        """
+        :param uds: 是否使用unix domain socket监听，socket文件位于当前进程的临时目录中
+        :param workers: 大于0时在workers个子进程中运行server，否则在子线程中运行
+        """
+        # path: (thread, server)，子进程中运行的server没有thread
+        self.servers = dict()
+        # 每个server的启动及关闭耗时: [(path, startup_time, shutdown_time)]
+        self.timings = list()
+        self.uds = uds
+        self.workers = workers
+        self.tmp_dir = None
+
+    def get(self, path):
+        """
+        获取path对应的server，不存在则启动一个
+        :param path: 应用目录
+        :return: server
+        """
+        if path not in self.servers:
+            uds = None
+            if self.uds:
+                if not self.tmp_dir:
+                    self.tmp_dir = tempfile.mkdtemp(prefix="apistellar-")
+                uds = os.path.join(
+                    self.tmp_dir, "%d.sock" % len(self.servers))
+            if self.workers:
+                self.servers[path] = (None, create_process_server(
+                    path, self.workers, uds=uds))
+            else:
+                self.servers[path] = create_server(path, uds=uds)
+        return self.servers[path][1]
+
+    def close(self):
+        servers = list(self.servers.items())
+        self.servers.clear()
+        for path, (th, server) in servers:
+            with profiler.timer("server_shutdown", path):
+                if th is None:
+                    stop_process_server(server)
+                else:
+                    stop_server(th, server)
+            self.timings.append(
+                (path, server.startup_time, server.shutdown_time))
+        if self.tmp_dir:
+            shutil.rmtree(self.tmp_dir, ignore_errors=True)
+            self.tmp_dir = None
+
+
+def bind_socket(port=None, uds=None, backlog=2048):
+    """
+    创建并绑定一个监听socket
+    :param port: tcp端口，不指定时由系统分配
+    :param uds: 指定后绑定unix domain socket
+    :param backlog:
+    :return: socket
+    """
+    if uds:
+        if os.path.exists(uds):
+            os.unlink(uds)
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.bind(uds)
     else:
-        raise RuntimeError("子线程启动超时！")
-    return container
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        # 接受的连接继承该选项，避免keep-alive连接上的小响应被Nagle算法延迟
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        sock.bind(("127.0.0.1", port or 0))
+    sock.listen(backlog)
+    return sock
 
 
-def free_port():
+class Resolver(object):
     """
-    Determines a free port using sockets.
+    字符串路径解析器，缓存每个路径中模块与属性的划分，
+    同时缓存无法导入的路径，重复解析时只需要从sys.modules中取出模块再依次取属性。
+    预热时会在多个线程中解析，缓存及计数的修改需要加锁，导入本身不加锁。
     """
-    free_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-    free_socket.bind(('0.0.0.0', 0))
-    free_socket.listen(5)
-    port = free_socket.getsockname()[1]
-    free_socket.close()
-    return port
+
+    def __init__(self):
+        # prop_str: (模块名, 属性列表)
+        self.splits = dict()
+        # prop_str: 导入失败时的异常
+        self.failures = dict()
+        # 导入失败的结果与sys.path相关，sys.path变化后失败缓存失效
+        self.sys_path = None
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def clear(self):
+        with self.lock:
+            self.splits.clear()
+            self.failures.clear()
+            self.hits = self.misses = 0
+
+    @staticmethod
+    def get_attrs(obj, attrs):
+        for attr in attrs:
+            obj = getattr(obj, attr)
+        return obj
+
+    def load(self, prop_str):
+        split = self.splits.get(prop_str)
+        if split:
+            module = sys.modules.get(split[0])
+            if module is not None:
+                with self.lock:
+                    self.hits += 1
+                return self.get_attrs(module, split[1])
+
+        sys_path = tuple(sys.path)
+        with self.lock:
+            if sys_path != self.sys_path:
+                self.failures.clear()
+                self.sys_path = sys_path
+            ex = self.failures.get(prop_str)
+            # 路径的某个前缀之后被放入了sys.modules(如手动注入的桩模块)，失败缓存失效
+            if ex and find_module(prop_str) is not None:
+                del self.failures[prop_str]
+                ex = None
+            if ex:
+                self.hits += 1
+            else:
+                self.misses += 1
+        if ex:
+            # 使用副本，保留name等属性，且不会在缓存的异常上累积traceback
+            raise copy(ex)
+
+        with profiler.timer("load", prop_str):
+            return self.import_attr(prop_str)
+
+    def walk(self, prop_str):
+        """
+        沿路径找到已存在的最深对象，返回该对象以及其后缺失的属性名列表
+        :param prop_str:
+        :return: (obj, [attr, ...])
+        """
+        try:
+            return self.load(prop_str), []
+        except AttributeError:
+            # 模块部分已导入成功，划分已缓存，属性缺失
+            split = self.splits.get(prop_str)
+            if split is None or split[0] not in sys.modules:
+                raise
+        obj = sys.modules[split[0]]
+        attrs = split[1]
+        for index, attr in enumerate(attrs):
+            try:
+                obj = getattr(obj, attr)
+            except AttributeError:
+                return obj, attrs[index:]
+        return obj, []
+
+    def import_attr(self, prop_str):
+        """
+        导入prop_str中的模块部分，缓存模块与属性的划分后返回对应的属性
+        :param prop_str:
+        :return:
+        """
+        attr_list = []
+        module_name = prop_str
+        ex = None
+        # 每次循环将module_name当模块路径查找，成功则返回，
+        # 失败则将模块路径回退一级，将回退的部分转换成属性
+        # 至到加载模块成功后依次从模块中提取属性。
+        while module_name:
+            module = sys.modules.get(module_name)
+            if module is None:
+                try:
+                    module = import_module(module_name)
+                except ImportError as e:
+                    module_name, _sep, attr_str = module_name.rpartition('.')
+                    attr_list.insert(0, attr_str)
+                    ex = e
+                    continue
+            with self.lock:
+                self.splits[prop_str] = (module_name, attr_list)
+            return self.get_attrs(module, attr_list)
+        else:
+            with self.lock:
+                self.failures[prop_str] = ex
+            raise ex
+
+
+resolver = Resolver()
 
 
 def load(prop_str):
@@ -69,23 +427,204 @@ def load(prop_str):
     :param prop_str: module1.class.function....
     :return: function
     """
-    attr_list = []
-    # 每次循环将prop_str当模块路径查找，成功则返回，
-    # 失败则将模块路径回退一级，将回退的部分转换成属性
-    # 至到加载模块成功后依次从模块中提取属性。
-    ex = None
+    return resolver.load(prop_str)
+
+
+def walk(prop_str):
+    """
+    返回路径中已存在的最深对象以及其后缺失的属性名列表
+    :param prop_str: module1.class.function....
+    :return: (obj, [attr, ...])
+    """
+    return resolver.walk(prop_str)
+
+
+def find_module(prop_str):
+    """
+    返回字符串表示的路径中，已导入的最长模块前缀所对应的模块
+    :param prop_str: module1.class.function....
+    :return: module or None
+    """
     while prop_str:
+        module = sys.modules.get(prop_str)
+        if module is not None:
+            return module
+        prop_str = prop_str.rpartition(".")[0]
+
+
+class Value(object):
+    """
+    ini中配置的值，使用时才求值
+    """
+    def __init__(self, raw):
+        self.raw = raw
+
+    def evaluate(self):
+        raise NotImplementedError
+
+    def __repr__(self):
+        return "<%s(%s)>" % (self.__class__.__name__, self.raw)
+
+
+class Literal(Value):
+    """
+    字面量
+    """
+    def __init__(self, raw, value):
+        super(Literal, self).__init__(raw)
+        self.value = value
+
+    def evaluate(self):
+        # 相同的配置共用一个Literal，可变的值每次返回一个副本
+        if isinstance(self.value, (list, dict, set)):
+            return deepcopy(self.value)
+        return self.value
+
+
+class Reference(Value):
+    """
+    模块、类、函数、属性等的引用，如os.path.join
+    """
+    def evaluate(self):
         try:
-            obj = __import__(prop_str, fromlist=prop_str.split(".")[-1])
-            for attr in attr_list:
-                obj = getattr(obj, attr)
-            return obj
-        except (AttributeError, ImportError) as e:
-            prop_str, _sep, attr_str = prop_str.rpartition('.')
-            attr_list.insert(0, attr_str)
-            ex = e
-    else:
-        raise ex
+            return load(self.raw)
+        except (ImportError, AttributeError):
+            try:
+                return getattr(builtins, self.raw)
+            except AttributeError:
+                return self.raw
+
+
+class Call(Value):
+    """
+    函数或类的调用，如collections.OrderedDict(a=1)
+    """
+    def __init__(self, raw, func, args, kwargs):
+        super(Call, self).__init__(raw)
+        self.func = func
+        self.args = args
+        self.kwargs = kwargs
+
+    def evaluate(self):
+        func = self.func.evaluate()
+        if not callable(func):
+            return self.raw
+        return func(*[arg.evaluate() for arg in self.args],
+                    **dict((key, val.evaluate())
+                           for key, val in self.kwargs.items()))
+
+
+class Subscript(Value):
+    """
+    下标取值，如factories.data["a"]
+    """
+    def __init__(self, raw, obj, key):
+        super(Subscript, self).__init__(raw)
+        self.obj = obj
+        self.key = key
+
+    def evaluate(self):
+        obj = self.obj.evaluate()
+        try:
+            return obj[self.key.evaluate()]
+        except (TypeError, LookupError):
+            return self.raw
+
+
+def dotted_name(node):
+    """
+    将Name/Attribute节点转换成点分路径，不是引用时返回None
+    """
+    names = list()
+    while isinstance(node, ast.Attribute):
+        names.insert(0, node.attr)
+        node = node.value
+    if isinstance(node, ast.Name):
+        names.insert(0, node.id)
+        return ".".join(names)
+
+
+def compile_value(node, raw):
+    """
+    将表达式节点编译成Value，不支持的表达式返回None
+    :param node:
+    :param raw: 表达式原文
+    :return: Value
+    """
+    try:
+        return Literal(raw, ast.literal_eval(node))
+    except (ValueError, TypeError, SyntaxError):
+        pass
+
+    name = dotted_name(node)
+    if name:
+        return Reference(name)
+
+    if isinstance(node, ast.Call):
+        func = dotted_name(node.func)
+        if not func or any(isinstance(arg, ast.Starred) for arg in node.args) \
+                or any(kw.arg is None for kw in node.keywords):
+            return None
+        args = [compile_value(arg, raw) for arg in node.args]
+        kwargs = dict((kw.arg, compile_value(kw.value, raw))
+                      for kw in node.keywords)
+        if None in args or None in kwargs.values():
+            return None
+        return Call(raw, Reference(func), args, kwargs)
+
+    if isinstance(node, ast.Subscript):
+        key = node.slice
+        # python3.8及以下下标被包装在Index中
+        key = getattr(key, "value", key) if key.__class__.__name__ == "Index" \
+            else key
+        obj = compile_value(node.value, raw)
+        key = compile_value(key, raw)
+        if obj is None or key is None:
+            return None
+        return Subscript(raw, obj, key)
+
+
+def parse_value(val):
+    """
+    将字符串表达式解析成Value，支持字面量、引用、调用和下标，
+    其它表达式当作字符串。解析结果按原文缓存在parsed_values中。
+    :param val:
+    :return: Value
+    """
+    value = parsed_values.get(val)
+    if value is missing:
+        with profiler.timer("guess", val):
+            try:
+                value = compile_value(
+                    ast.parse(val.strip(), mode="eval").body, val)
+            except SyntaxError:
+                value = None
+            value = parsed_values.setdefault(val, value or Literal(val, val))
+    return value
+
+
+def lazy_value(val):
+    """
+    解析字符串表达式，字面量直接返回值，其它的返回Value，在使用时求值
+    :param val:
+    :return:
+    """
+    value = parse_value(val)
+    if isinstance(value, Literal):
+        return value.evaluate()
+    return value
+
+
+def resolve(val):
+    """
+    对lazy_value的返回值求值
+    :param val:
+    :return:
+    """
+    if isinstance(val, Value):
+        with profiler.timer("evaluate", val.raw):
+            return val.evaluate()
+    return val
 
 
 def guess(val):
@@ -94,26 +633,7 @@ def guess(val):
     @param val:
     @return:
     """
-    try:
-        return eval(val)
-    except NameError:
-        # 如果报错了，可能是字符串描述的模块没有导入，则导入模块
-        try:
-            # 寻找[或(，来判断是否需要执行方法或函数
-            mth = re.search(r"[\[\(]", val)
-            # 如果存在，则证明需要调用函数或类
-            if mth:
-                prop_str, args_str = val[:mth.start()], val[mth.start():]
-                prop = load(prop_str)
-                prop_name = "_local_prop_name"
-                locals()[prop_name] = prop
-                return eval(prop_name + args_str)
-            else:
-                return load(val)
-        except (ImportError, NameError, AttributeError):
-            return val
-    except SyntaxError:
-        return val
+    return parse_value(val).evaluate()
 
 
 def cache_property(func):
@@ -158,11 +678,97 @@ def cache_classproperty(func):
     return wrapper
 
 
+class LRUCache(object):
+    """
+    线程安全的LRU缓存，超过maxsize时淘汰最久未使用的值
+    """
+    default_size = 128
+
+    def __init__(self, maxsize=None):
+        self.maxsize = maxsize or self.default_size
+        self.data = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        """
+        返回key对应的值，key为None或不存在时返回missing
+        :param key:
+        :return:
+        """
+        if key is None:
+            return missing
+        with self.lock:
+            val = self.data.pop(key, missing)
+            if val is not missing:
+                self.data[key] = val
+            return val
+
+    def setdefault(self, key, val):
+        """
+        key不存在时保存val，返回key对应的值，
+        并发计算同一个key时，保证所有调用者拿到的是同一个值
+        :param key:
+        :param val:
+        :return:
+        """
+        if key is None:
+            return val
+        with self.lock:
+            if key in self.data:
+                return self.data[key]
+            self.put(key, val)
+            return val
+
+    def put(self, key, val):
+        self.data[key] = val
+        while len(self.data) > self.maxsize:
+            self.data.popitem(last=False)
+
+    def __getitem__(self, key):
+        val = self.get(key)
+        if val is missing:
+            raise KeyError(key)
+        return val
+
+    def __setitem__(self, key, val):
+        with self.lock:
+            self.data.pop(key, None)
+            self.put(key, val)
+
+    def clear(self):
+        with self.lock:
+            self.data.clear()
+
+    def __len__(self):
+        return len(self.data)
+
+
+# parse_value的解析结果，key为表达式原文
+parsed_values = LRUCache(1024)
+
+
+def make_key(args, kwargs):
+    """
+    使用调用参数生成缓存的key，参数不可hash时返回None
+    :param args:
+    :param kwargs:
+    :return:
+    """
+    key = (args, frozenset(kwargs.items()))
+    try:
+        hash(key)
+    except TypeError:
+        return None
+    return key
+
+
 class MarkerWrapper(object):
     """
     Mark类__eq__使用(name, args, kwargs)是否相同来判断，
     无法满足去重的要求，所以使用这个类来包装一下使用id来去重。
     """
+    __slots__ = ("marker", )
+
     def __init__(self, marker):
         self.marker = marker
 
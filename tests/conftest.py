@@ -0,0 +1,87 @@
+# -*- coding:utf-8 -*-
+import sys
+import pytest
+import textwrap
+
+from importlib import import_module
+
+pytest_plugins = ["pytester"]
+
+
+class Node(object):
+    """
+    测试用的节点，支持获取mark、注册finalizer及查找父节点
+    """
+
+    def __init__(self, marks=(), parent=None, kind=None):
+        """
+        :param marks:
+        :param parent: 父节点
+        :param kind: 节点类型，如pytest.Module，getparent按其查找
+        """
+        self.marks = marks
+        self.parent = parent
+        self.kind = kind
+        self.finalizers = list()
+
+    def iter_markers(self, name):
+        return [mark for mark in self.marks if mark.name == name]
+
+    def addfinalizer(self, func):
+        self.finalizers.append(func)
+
+    def getparent(self, cls):
+        node = self
+        while node is not None and node.kind is not cls:
+            node = node.parent
+        return node
+
+    def teardown(self):
+        while self.finalizers:
+            self.finalizers.pop()()
+
+
+class Request(object):
+    """
+    测试用的request，不依赖任何fixture
+    """
+    _arg2fixturedefs = dict()
+    fixturenames = ()
+
+    def __init__(self, scope, *marks, node=None):
+        self.scope = scope
+        self.node = node or Node(marks)
+
+
+@pytest.fixture
+def make_node():
+    """
+    返回测试用的节点类Node(marks=(), parent=None, kind=None)
+    """
+    return Node
+
+
+@pytest.fixture
+def make_request():
+    """
+    返回测试用的request类Request(scope, *marks, node=None)
+    """
+    return Request
+
+
+@pytest.fixture
+def make_module(tmp_path, monkeypatch):
+    """
+    在临时目录中生成模块并导入，可以被重新加载，测试结束后从sys.modules中移除
+    """
+    names = list()
+    monkeypatch.syspath_prepend(str(tmp_path))
+
+    def make(name, source=""):
+        tmp_path.joinpath(name + ".py").write_text(textwrap.dedent(source))
+        names.append(name)
+        return import_module(name)
+
+    yield make
+    for name in names:
+        sys.modules.pop(name, None)
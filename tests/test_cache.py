@@ -0,0 +1,96 @@
+# -*- coding:utf-8 -*-
+import pytest
+
+from pytest_apistellar.patcher import PropPatcher
+from pytest_apistellar.utils import LRUCache, MarkerWrapper, missing
+
+
+def new_object(*args, **kwargs):
+    return [args, kwargs]
+
+
+pytestmark = [
+    pytest.mark.prop("factories.TestClass.get_data_module",
+                     ret_factory=new_object, cache="module")
+]
+
+
+@pytest.mark.prop("factories.TestClass.get_data_function",
+                  ret_factory=new_object, cache="function")
+def test_module_level_function_cache():
+    from factories import TestClass
+    # 不在class中的单元测试的mark属于function作用域
+    assert TestClass.get_data_function("a") is TestClass.get_data_function("a")
+
+
+class TestCache(object):
+
+    def test_module_cache(self):
+        from factories import TestClass
+        assert TestClass.get_data_module("a") is TestClass.get_data_module("a")
+        assert TestClass.get_data_module("a") is not \
+            TestClass.get_data_module("b")
+
+    @pytest.mark.prop("factories.TestClass.get_data_function",
+                      ret_factory=new_object, cache="function")
+    def test_function_cache(self):
+        from factories import TestClass
+        assert TestClass.get_data_function("a") is \
+            TestClass.get_data_function("a")
+
+    @pytest.mark.prop("factories.TestClass.get_data_function",
+                      ret_factory=new_object, cache="function")
+    def test_unhashable(self):
+        from factories import TestClass
+        assert TestClass.get_data_function([1]) is not \
+            TestClass.get_data_function([1])
+
+    def test_cache_scope(self, make_node, make_request):
+        mark = pytest.mark.prop("factories.TestClass.get_data_function",
+                                ret_factory=new_object, cache="module").mark
+        module = make_node(kind=pytest.Module)
+        first = make_request("function", node=make_node(parent=module))
+        second = make_request("function", node=make_node(parent=module))
+        patcher = PropPatcher([mark])
+        cache = patcher.factory_cache(mark, "module", None, first)
+        # 同一模块中的单元测试共享module作用域的缓存
+        assert patcher.factory_cache(mark, "module", None, second) is cache
+        assert patcher.factory_cache(mark, "function", None, first) is not \
+            patcher.factory_cache(mark, "function", None, second)
+
+        cache.setdefault("a", 1)
+        first.node.teardown()
+        second.node.teardown()
+        assert cache.get("a") == 1
+        module.teardown()
+        assert cache.get("a") is missing
+        assert (MarkerWrapper(mark), module) not in PropPatcher.caches
+
+    def test_narrower_scope(self, make_request):
+        mark = pytest.mark.prop("factories.TestClass.get_data_function",
+                                ret_factory=new_object, cache="function").mark
+        with PropPatcher([mark]) as patcher:
+            with pytest.raises(ValueError):
+                patcher.apply_mark(mark, make_request("module"))
+
+    def test_invalid_scope(self):
+        mark = pytest.mark.prop("factories.TestClass.get_data_function",
+                                ret_factory=new_object, cache="test").mark
+        with PropPatcher([mark]) as patcher:
+            with pytest.raises(ValueError):
+                patcher.apply_mark(mark, None)
+
+
+class TestLRUCache(object):
+
+    def test_evict(self):
+        cache = LRUCache(2)
+        cache.setdefault("a", 1)
+        cache.setdefault("b", 2)
+        assert cache.get("a") == 1
+        cache.setdefault("c", 3)
+        assert len(cache) == 2
+        assert cache.get("a") == 1
+        assert cache.get("b") is missing
+        assert cache.setdefault("c", 4) == 3
+        assert cache.setdefault(None, 5) == 5
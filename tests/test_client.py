@@ -0,0 +1,49 @@
+# -*- coding:utf-8 -*-
+import json
+import asyncio
+
+from pytest_apistellar.client import ASGIClient
+
+
+async def asgi3_app(scope, receive, send):
+    message = await receive()
+    body = json.dumps({
+        "method": scope["method"],
+        "path": scope["path"],
+        "query": scope["query_string"].decode(),
+        "body": message["body"].decode(),
+    }).encode()
+    await send({"type": "http.response.start", "status": 200,
+                "headers": [(b"content-type", b"application/json")]})
+    await send({"type": "http.response.body", "body": body})
+
+
+def asgi2_app(scope):
+    async def asgi(receive, send):
+        await asgi3_app(scope, receive, send)
+    return asgi
+
+
+class TestASGIClient(object):
+
+    def test_asgi3(self):
+        async def request():
+            client = ASGIClient(asgi3_app)
+            resp = await client.get("/mimetype/", params={"a": 1})
+            assert resp.status == 200
+            assert resp.content_type == "application/json"
+            return await resp.json()
+
+        data = asyncio.run(request())
+        assert data["path"] == "/mimetype/"
+        assert data["query"] == "a=1"
+
+    def test_asgi2(self):
+        async def request():
+            async with ASGIClient(asgi2_app) as session:
+                async with session.post("/upload", json={"a": 1}) as resp:
+                    return await resp.json()
+
+        data = asyncio.run(request())
+        assert data["method"] == "POST"
+        assert json.loads(data["body"]) == {"a": 1}
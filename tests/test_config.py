@@ -0,0 +1,94 @@
+# -*- coding:utf-8 -*-
+from pytest_apistellar.utils import Value
+from pytest_apistellar.patcher import PropPatcher, EnvPatcher, compile_config
+
+
+class Cache(dict):
+
+    def set(self, key, value):
+        self[key] = value
+
+
+class Config(object):
+
+    def __init__(self, **inicfg):
+        self.inicfg = inicfg
+        self.cache = Cache()
+
+    def getini(self, name):
+        return False
+
+
+class TestConfigCache(object):
+
+    def test_cache_marks(self):
+        config = Config(env="APP_NAME=123\nAPP_TARGET='preview'")
+        marks = EnvPatcher.from_pytestconfig(config).markers
+        assert [m.kwargs for m in marks] == [
+            {"APP_NAME": 123}, {"APP_TARGET": "preview"}]
+        cached = config.cache["apistellar/env"]
+        assert cached["marks"][0] == {"args": [], "kwargs": {"APP_NAME": 123}}
+        # 命中缓存时使用缓存的结果，而不是重新解析
+        cached["marks"][0]["kwargs"]["APP_NAME"] = 456
+        marks = EnvPatcher.from_pytestconfig(config).markers
+        assert marks[0].kwargs == {"APP_NAME": 456}
+
+    def test_cache_invalid_after_change(self):
+        config = Config(env="APP_NAME=123")
+        EnvPatcher.from_pytestconfig(config)
+        config.inicfg["env"] = "APP_NAME=789"
+        marks = EnvPatcher.from_pytestconfig(config).markers
+        assert marks[0].kwargs == {"APP_NAME": 789}
+
+    def test_cache_invalid_after_upgrade(self, monkeypatch):
+        config = Config(env="APP_NAME=123")
+        EnvPatcher.from_pytestconfig(config)
+        config.cache["apistellar/env"]["marks"][0]["kwargs"]["APP_NAME"] = 456
+        # 插件升级或序列化格式变化后，旧的缓存不再使用
+        monkeypatch.setattr(EnvPatcher, "config_format", 0)
+        marks = EnvPatcher.from_pytestconfig(config).markers
+        assert marks[0].kwargs == {"APP_NAME": 123}
+        monkeypatch.setattr("pytest_apistellar.patcher.__version__", "0.0.0")
+        config.cache["apistellar/env"]["marks"][0]["kwargs"]["APP_NAME"] = 456
+        marks = EnvPatcher.from_pytestconfig(config).markers
+        assert marks[0].kwargs == {"APP_NAME": 123}
+
+    def test_cache_raw(self):
+        config = Config(prop="os.sep=(1, 2)")
+        PropPatcher.from_pytestconfig(config)
+        assert config.cache["apistellar/prop"]["marks"] == [
+            {"raw": "os.sep=(1, 2)"}]
+        marks = PropPatcher.from_pytestconfig(config).markers
+        assert marks[0].kwargs == {"ret_val": (1, 2)}
+
+    def test_cache_lazy_value(self):
+        config = Config(prop="os.sep=os.path.join")
+        PropPatcher.from_pytestconfig(config)
+        assert config.cache["apistellar/prop"]["marks"] == [
+            {"args": ["os.sep"], "kwargs": {
+                "ret_val": {"__value__": "os.path.join"}}}]
+        import os
+        marks = PropPatcher.from_pytestconfig(config).markers
+        assert isinstance(marks[0].kwargs["ret_val"], Value)
+        assert marks[0].kwargs["ret_val"].evaluate() is os.path.join
+
+
+class TestWorkerInput(object):
+
+    def test_compile_config(self):
+        config = Config(env="APP_NAME=123", prop="os.sep=os.path.join")
+        compiled = compile_config(config)
+        assert set(compiled) == {"env", "prop"}
+        assert compiled["prop"]["marks"][0]["kwargs"] == {
+            "ret_val": {"__value__": "os.path.join"}}
+
+    def test_use_workerinput(self):
+        master = Config(env="APP_NAME=123")
+        worker = Config(env="APP_NAME=123")
+        worker.workerinput = {"apistellar_mocks": compile_config(master)}
+        worker.workerinput["apistellar_mocks"]["env"]["marks"][0][
+            "kwargs"]["APP_NAME"] = 456
+        marks = EnvPatcher.from_pytestconfig(worker).markers
+        assert marks[0].kwargs == {"APP_NAME": 456}
+        # worker使用主进程的结果，不写入cache
+        assert not worker.cache
@@ -0,0 +1,121 @@
+# -*- coding:utf-8 -*-
+import types
+import asyncio
+import pytest
+
+from pytest_apistellar.patcher import PropPatcher
+from pytest_apistellar.context import dispatcher
+
+
+@pytest.fixture
+def module(make_module):
+    return make_module("context_target", """
+        class Base(object):
+
+            def inherited(self):
+                return "base"
+
+
+        class Target(Base):
+            value = 1
+
+            def method(self):
+                return "method"
+
+            @classmethod
+            def cls_method(cls):
+                return cls.value
+
+
+        async def fetch(val):
+            return val
+
+
+        func = lambda: "func"
+        """)
+
+
+def context_patcher(*marks):
+    patcher = PropPatcher(marks)
+    patcher.context = True
+    for mark in marks:
+        patcher.process_mark(mark, None)
+    return patcher
+
+
+def run(coro):
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(coro)
+    finally:
+        loop.close()
+
+
+class TestContextProp(object):
+
+    def test_fallback(self, module):
+        target = module.Target
+        marks = [pytest.mark.prop("context_target.Target.%s" % name,
+                                  ret_val="mock").mark
+                 for name in ("value", "method", "cls_method", "inherited")]
+        marks.append(pytest.mark.prop("context_target.func",
+                                      ret_val="mock").mark)
+        with context_patcher(*marks):
+            assert target.value == "mock"
+            assert target().method() == "mock"
+            assert target.cls_method() == "mock"
+            assert target().inherited() == "mock"
+            assert module.func() == "mock"
+            # 其它上下文中使用原属性
+            assert run(self.original(module)) == (
+                1, "method", 1, "base", "func")
+        assert "value" in target.__dict__
+        assert "inherited" not in target.__dict__
+        assert module.func() == "func"
+        assert not dispatcher.installs
+
+    async def original(self, module):
+        from pytest_apistellar.context import mocks
+        # 任务复制了创建时的上下文，清空后模拟没有mock的上下文
+        mocks.set(None)
+        target = module.Target
+        return (target.value, target().method(), target.cls_method(),
+                target().inherited(), module.func())
+
+    def test_concurrent(self, module):
+
+        async def case(val):
+            mark = pytest.mark.prop(
+                "context_target.fetch", ret_val=val, asyncable=True).mark
+            value = pytest.mark.prop("context_target.Target.value",
+                                     ret_val=val).mark
+            with context_patcher(mark, value):
+                await asyncio.sleep(0.01)
+                return await module.fetch(0), module.Target.value
+
+        async def main():
+            return await asyncio.gather(*[case(i) for i in range(1, 4)])
+
+        assert run(main()) == [(1, 1), (2, 2), (3, 3)]
+        assert run(module.fetch(0)) == 0
+        assert module.Target.value == 1
+        assert not dispatcher.installs
+
+    def test_global_fallback(self, module):
+        mark = pytest.mark.prop("context_target.constant", ret_val=2).mark
+        with context_patcher(mark):
+            assert module.constant == 2
+            assert run(self.constant(module)) == 2
+        assert not hasattr(module, "constant")
+
+    async def constant(self, module):
+        # 模块上的非可调用属性无法分发，全局生效
+        return module.constant
+
+    @pytest.mark.parametrize("fixturenames, workers, threaded", [
+        (["server"], "0", True), (["server"], "2", False), (["mock"], "0", False)])
+    def test_threaded_server(self, fixturenames, workers, threaded):
+        config = types.SimpleNamespace(getini={"server_workers": workers}.get)
+        request = types.SimpleNamespace(fixturenames=fixturenames, config=config)
+        # 子线程中的server看不到上下文中的mock
+        assert PropPatcher.threaded_server(request) is threaded
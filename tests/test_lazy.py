@@ -0,0 +1,57 @@
+# -*- coding:utf-8 -*-
+import sys
+import pytest
+
+from pytest_apistellar.lazy import finder
+from pytest_apistellar.patcher import PropPatcher
+
+
+@pytest.fixture
+def package(tmp_path, monkeypatch):
+    pkg = tmp_path.joinpath("lazy_target")
+    pkg.mkdir()
+    pkg.joinpath("__init__.py").write_text("")
+    pkg.joinpath("model.py").write_text(
+        "class Target(object):\n    value = 1\n")
+    monkeypatch.syspath_prepend(str(tmp_path))
+    yield pkg
+    for name in ("lazy_target", "lazy_target.model"):
+        sys.modules.pop(name, None)
+
+
+class TestLazy(object):
+
+    def test_defer_until_import(self, package):
+        mark = pytest.mark.prop("lazy_target.model.Target.value", ret_val=2).mark
+        patcher = PropPatcher([mark])
+        patcher.lazy = True
+        with patcher:
+            patcher.process_mark(mark, None)
+            assert "lazy_target" not in sys.modules
+            import lazy_target
+            assert "lazy_target.model" not in sys.modules
+            from lazy_target.model import Target
+            assert Target.value == 2
+            assert finder not in sys.meta_path
+        assert Target.value == 1
+
+    def test_apply_when_imported(self, package):
+        from lazy_target.model import Target
+        mark = pytest.mark.prop("lazy_target.model.Target.value", ret_val=3).mark
+        patcher = PropPatcher([mark])
+        patcher.lazy = True
+        with patcher:
+            patcher.process_mark(mark, None)
+            assert Target.value == 3
+        assert Target.value == 1
+
+    def test_discard_on_exit(self, package):
+        mark = pytest.mark.prop("lazy_target.model.Target.value", ret_val=4).mark
+        patcher = PropPatcher([mark])
+        patcher.lazy = True
+        with patcher:
+            patcher.process_mark(mark, None)
+            assert finder in sys.meta_path
+        assert finder not in sys.meta_path
+        from lazy_target.model import Target
+        assert Target.value == 1
@@ -1,5 +1,10 @@
+import os
+import sys
+import types
 import pytest
-from pytest_apistellar.utils import load
+
+from pytest_apistellar.utils import load, guess, Resolver, parse_value, \
+    Literal, Reference
 
 
 class TestLoad(object):
@@ -13,4 +18,103 @@ class TestLoad(object):
 
     def test_load_not_found_module(self):
         with pytest.raises(ImportError):
-            load("fdsff")
\ No newline at end of file
+            load("fdsff")
+
+class TestResolver(object):
+
+    def test_resolver_cache_split(self):
+        resolver = Resolver()
+        assert resolver.load("os.path.join") is os.path.join
+        assert resolver.misses == 1
+        assert resolver.splits["os.path.join"] == ("os.path", ["join"])
+        assert resolver.load("os.path.join") is os.path.join
+        assert resolver.hits == 1
+
+    def test_resolver_not_cache_attr(self, monkeypatch):
+        resolver = Resolver()
+        with pytest.raises(AttributeError):
+            resolver.load("os.not_exists_attr")
+        monkeypatch.setattr(os, "not_exists_attr", 1, raising=False)
+        assert resolver.load("os.not_exists_attr") == 1
+
+    def test_resolver_cache_failure(self, monkeypatch, tmp_path):
+        resolver = Resolver()
+        for i in range(2):
+            with pytest.raises(ImportError):
+                resolver.load("resolver_target")
+        assert resolver.misses == 1
+        assert resolver.hits == 1
+        tmp_path.joinpath("resolver_target.py").write_text("a = 1\n")
+        monkeypatch.syspath_prepend(str(tmp_path))
+        try:
+            assert resolver.load("resolver_target").a == 1
+        finally:
+            sys.modules.pop("resolver_target", None)
+
+    def test_resolver_failure_stub_module(self, monkeypatch):
+        resolver = Resolver()
+        with pytest.raises(ImportError) as exc_info:
+            resolver.load("resolver_stub.attr")
+        with pytest.raises(ImportError) as cached_info:
+            resolver.load("resolver_stub.attr")
+        assert cached_info.value.name == exc_info.value.name == "resolver_stub"
+        # 之后手动注入的桩模块
+        stub = types.ModuleType("resolver_stub")
+        stub.attr = 42
+        monkeypatch.setitem(sys.modules, "resolver_stub", stub)
+        assert resolver.load("resolver_stub.attr") == 42
+
+    def test_resolver_threads(self, monkeypatch):
+        from concurrent.futures import ThreadPoolExecutor
+        resolver = Resolver()
+        with pytest.raises(ImportError):
+            resolver.load("resolver_stub.attr")
+        stub = types.ModuleType("resolver_stub")
+        stub.attr = 42
+        monkeypatch.setitem(sys.modules, "resolver_stub", stub)
+        # 预热时多个线程同时解析同一个失效的失败缓存
+        with ThreadPoolExecutor(8) as executor:
+            results = list(executor.map(
+                lambda _: resolver.load("resolver_stub.attr"), range(200)))
+        assert results == [42] * 200
+        assert resolver.hits + resolver.misses == 201
+
+
+class TestParseValue(object):
+
+    def test_cache(self, monkeypatch):
+        from pytest_apistellar import utils
+        monkeypatch.setattr(utils, "parsed_values", utils.LRUCache(1))
+        value = parse_value("os.sep")
+        assert parse_value("os.sep") is value
+        # 超过大小时淘汰最久未使用的解析结果
+        parse_value("os.pathsep")
+        assert len(utils.parsed_values) == 1
+        assert parse_value("os.sep") is not value
+
+    def test_literal(self):
+        value = parse_value("{'a': [1, 2]}")
+        assert isinstance(value, Literal)
+        assert value.evaluate() == {"a": [1, 2]}
+        assert value.evaluate() is not value.evaluate()
+        assert parse_value("{'a': [1, 2]}") is value
+
+    def test_reference(self):
+        value = parse_value("os.path.join")
+        assert isinstance(value, Reference)
+        assert value.evaluate() is os.path.join
+        assert guess("not_exists_module.attr") == "not_exists_module.attr"
+
+    def test_call(self):
+        assert guess("collections.OrderedDict(a=1)") == {"a": 1}
+        assert guess("dict(a=os.sep)") == {"a": os.sep}
+        assert guess("os.path.join('a', 'b')") == os.path.join("a", "b")
+
+    def test_subscript(self):
+        assert guess("os.environ['PATH']") == os.environ["PATH"]
+
+    def test_unsupported(self):
+        assert guess("../") == "../"
+        assert guess("1 + 2") == "1 + 2"
+        assert guess("__import__('os').system('echo')") == \
+            "__import__('os').system('echo')"
@@ -0,0 +1,108 @@
+# -*- coding:utf-8 -*-
+import json
+import pytest
+import threading
+
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+from pytest_apistellar.loadgen import Histogram, LoadGenerator, dump_reports
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        body = b"ok" if self.path == "/" else b""
+        self.send_response(200 if body else 404)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class Config(object):
+    host = "127.0.0.1"
+    uds = None
+
+    def __init__(self, port):
+        self.port = port
+
+
+@pytest.fixture(scope="module")
+def http_server():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    server.daemon_threads = True
+    th = threading.Thread(target=server.serve_forever)
+    th.daemon = True
+    th.start()
+    yield Config(server.server_address[1])
+    server.shutdown()
+    server.server_close()
+
+
+class TestHistogram(object):
+
+    def test_percentile(self):
+        histogram = Histogram()
+        size = len(histogram.counts)
+        for i in range(1, 1001):
+            histogram.record(i / 1000.0)
+        assert len(histogram.counts) == size
+        assert histogram.count == 1000
+        assert histogram.percentile(50) == pytest.approx(0.5, rel=0.01)
+        assert histogram.percentile(99) == pytest.approx(0.99, rel=0.01)
+        assert histogram.percentile(100) == 1.0
+        assert histogram.percentile(0) == pytest.approx(0.001, rel=0.01)
+        assert histogram.mean == pytest.approx(0.5005)
+
+    def test_out_of_range(self):
+        histogram = Histogram(lowest=0.001, highest=1)
+        histogram.record(0)
+        histogram.record(10)
+        assert histogram.percentile(50) == 0.001
+        assert histogram.percentile(100) == 10
+        assert Histogram().percentile(50) is None
+
+
+class TestLoadGenerator(object):
+
+    def test_closed_loop(self, http_server):
+        results = list()
+        load = LoadGenerator(http_server, results.append)
+        result = load("/", requests=50, concurrency=4)
+        assert results == [result]
+        assert result.requests == 50
+        assert result.errors == 0
+        assert result.status == {200: 50}
+        assert result.throughput > 0
+        assert 0 < result.p50 <= result.p95 <= result.p99
+
+    def test_rate(self, http_server):
+        result = LoadGenerator(http_server)(
+            "/missing", requests=20, rate=200, concurrency=2)
+        assert result.status == {404: 20}
+        assert result.mode == "rate"
+        # 20个请求按每秒200个的速率发起至少需要95ms
+        assert result.duration >= 0.095
+
+    def test_duration(self, http_server):
+        result = LoadGenerator(http_server)("/", duration=0.1, concurrency=2)
+        assert result.requests > 0
+        assert result.duration >= 0.1
+
+    def test_errors(self):
+        result = LoadGenerator(Config(1))("/", requests=3, concurrency=1)
+        assert result.errors == 3
+        assert result.p50 is None
+
+    def test_report(self, http_server, tmp_path):
+        result = LoadGenerator(http_server)("/", requests=5, name="index")
+        filename = str(tmp_path / "report.json")
+        dump_reports(filename, [result.to_dict()])
+        with open(filename) as f:
+            report = json.load(f)["results"][0]
+        assert report["name"] == "index"
+        assert report["status"] == {"200": 5}
+        assert report["latency"]["count"] == 5
@@ -23,3 +23,16 @@ class TestPropPatcher(object):
         assert TestClass.get_data_function() == a * 5
         assert TestClass.get_data_class() == 4
         assert TestClass.get_data_module() == 3
+
+
+@pytest.fixture
+def db():
+    return "db"
+
+
+@pytest.mark.prop("factories.TestClass.get_data_function",
+                  ret_factory=lambda db: db * 2, fixture_inject=True)
+def test_inject_later(mock, db):
+    from factories import TestClass
+    # db在mock之后创建，工厂第一次被调用时才获取
+    assert TestClass.get_data_function() == "dbdb"
@@ -0,0 +1,137 @@
+# -*- coding:utf-8 -*-
+import sys
+import pytest
+
+from importlib import reload
+from pytest_apistellar.patcher import PropPatcher
+from pytest_apistellar.utils import MarkerWrapper, LRUCache
+
+
+@pytest.fixture
+def module(make_module):
+    return make_module("plan_target", """
+        class Target(object):
+            value = 1
+        """)
+
+
+class TestPlan(object):
+
+    def apply(self, mark):
+        with PropPatcher([mark]) as patcher:
+            patcher.process_mark(mark, None)
+            return sys.modules["plan_target"].Target.value
+
+    def test_plan_reuse(self, module):
+        mark = pytest.mark.prop("plan_target.Target.value", ret_val=2).mark
+        assert self.apply(mark) == 2
+        plan = PropPatcher.plans[MarkerWrapper(mark)]
+        assert self.apply(mark) == 2
+        assert PropPatcher.plans[MarkerWrapper(mark)] is plan
+        assert module.Target.value == 1
+
+    def test_plan_invalid_after_reload(self, module):
+        mark = pytest.mark.prop("plan_target.Target.value", ret_val=3).mark
+        assert self.apply(mark) == 3
+        plan = PropPatcher.plans[MarkerWrapper(mark)]
+        assert plan.valid
+        reload(module)
+        assert not plan.valid
+        assert self.apply(mark) == 3
+        assert module.Target.value == 1
+
+    def test_plan_invalid_after_owner_replaced(self, module, monkeypatch):
+        mark = pytest.mark.prop("plan_target.Target.value", ret_val=4).mark
+        assert self.apply(mark) == 4
+        plan = PropPatcher.plans[MarkerWrapper(mark)]
+        monkeypatch.setattr(module, "Target", type("Target", (object, ), {
+            "value": 0}))
+        assert not plan.valid
+        assert self.apply(mark) == 4
+        assert module.Target.value == 0
+
+    def test_plan_evict(self, module, monkeypatch):
+        monkeypatch.setattr(PropPatcher, "_plans", LRUCache(1))
+        marks = [pytest.mark.prop("plan_target.Target.value", ret_val=i).mark
+                 for i in range(2)]
+        for mark in marks:
+            self.apply(mark)
+        assert len(PropPatcher.plans) == 1
+        assert MarkerWrapper(marks[0]) not in PropPatcher.plans.data
+
+    def test_plan_missing_ancestors(self, module):
+        mark_a = pytest.mark.prop("plan_target.Target.a.b.c", ret_val=4).mark
+        mark_d = pytest.mark.prop("plan_target.Target.a.b.d", ret_val=5).mark
+        for _ in range(2):
+            with PropPatcher([mark_a, mark_d]) as patcher:
+                patcher.process_mark(mark_a, None)
+                patcher.process_mark(mark_d, None)
+                target = sys.modules["plan_target"].Target
+                assert target.a.b.c == 4
+                assert target.a.b.d == 5
+            assert not hasattr(module.Target, "a")
+        # 计划从真实存在的对象开始，单独应用时也能生成占位祖先
+        assert len(PropPatcher.plans[MarkerWrapper(mark_d)].props) == 3
+        with PropPatcher([mark_d]) as patcher:
+            patcher.process_mark(mark_d, None)
+            assert sys.modules["plan_target"].Target.a.b.d == 5
+        assert not hasattr(module.Target, "a")
+
+
+class TestProp(object):
+
+    def test_prop_immutable(self, module):
+        mark = pytest.mark.prop("plan_target.Target.value", ret_val=6).mark
+        with PropPatcher([mark]) as patcher:
+            patcher.process_mark(mark, None)
+        prop = PropPatcher.plans[MarkerWrapper(mark)].props[0]
+        with pytest.raises(AttributeError):
+            prop.ret_val = 7
+        assert not hasattr(prop, "__dict__")
+        assert prop.replace(ret_val=7).ret_val == 7
+        assert prop.ret_val == 6
+
+    def test_stand_in(self, module):
+        mark = pytest.mark.prop(
+            "plan_target.Target.value", ret_val=8, callable=True).mark
+        with PropPatcher([mark]) as patcher:
+            patcher.process_mark(mark, None)
+            stub = module.Target.value
+            # 类属性的替身不会被绑定成方法
+            assert stub() == module.Target().value() == 8
+            assert stub.callable and not stub.asyncable
+
+    def test_stand_in_factory(self, module):
+        mark = pytest.mark.prop(
+            "plan_target.Target.value", "b", callable=True,
+            ret_factory=lambda *args, **kwargs: (args, kwargs), c=1).mark
+        with PropPatcher([mark]) as patcher:
+            patcher.process_mark(mark, None)
+            assert module.Target().value("a", c=2) == (("a", "b"), {"c": 1})
+
+    def test_stand_in_async(self, module):
+        import asyncio
+
+        async def factory(val):
+            return val + 1
+
+        mark = pytest.mark.prop("plan_target.Target.value", callable=True,
+                                asyncable=True, ret_factory=factory).mark
+        with PropPatcher([mark]) as patcher:
+            patcher.process_mark(mark, None)
+            stub = module.Target.value
+            assert asyncio.iscoroutinefunction(stub)
+            loop = asyncio.new_event_loop()
+            try:
+                assert loop.run_until_complete(stub(1)) == 2
+            finally:
+                loop.close()
+
+    def test_release_total_markers(self, module, make_request):
+        mark = pytest.mark.prop("plan_target.Target.value", ret_val=9).mark
+        with PropPatcher([mark]) as patcher:
+            patcher.process(make_request("module"))
+            assert PropPatcher.total_markers[MarkerWrapper(mark)] == "module"
+            assert module.Target.value == 9
+        assert MarkerWrapper(mark) not in PropPatcher.total_markers
+        assert module.Target.value == 1
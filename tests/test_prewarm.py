@@ -0,0 +1,51 @@
+# -*- coding:utf-8 -*-
+import pytest
+import threading
+
+from pytest_apistellar.patcher import PropPatcher
+
+
+def fail_factory():
+    raise ValueError("broken")
+
+
+class TestPrewarm(object):
+
+    def patcher(self, marks):
+        patcher = PropPatcher(marks)
+        patcher.prewarm_workers = 4
+        return patcher
+
+    def test_prewarm(self, make_module, make_request):
+        module = make_module("prewarm_target")
+        # 4个工厂同时在等待时才会放行，串行执行时会超时
+        barrier = threading.Barrier(4, timeout=5)
+
+        def factory():
+            barrier.wait()
+            return threading.get_ident()
+
+        marks = [pytest.mark.prop("prewarm_target.attr%d" % i,
+                                  ret_factory=factory).mark
+                 for i in range(4)]
+        with self.patcher(marks) as patcher:
+            patcher.process(make_request("session"))
+            idents = [getattr(module, "attr%d" % i) for i in range(4)]
+            assert len(set(idents)) == 4
+            assert threading.get_ident() not in idents
+        assert not hasattr(module, "attr0")
+
+    def test_errors(self, make_module, make_request):
+        module = make_module("prewarm_target")
+        marks = [pytest.mark.prop("prewarm_target.attr%d" % i,
+                                  ret_factory=fail_factory).mark
+                 for i in range(2)] + [
+            pytest.mark.prop("prewarm_target.a", ret_val=1).mark]
+        with self.patcher(marks) as patcher:
+            with pytest.raises(RuntimeError) as exc_info:
+                patcher.process(make_request("session"))
+        message = str(exc_info.value)
+        assert "2 prop mock(s)" in message
+        assert "prewarm_target.attr0: ValueError: broken" in message
+        assert "prewarm_target.attr1" in message
+        assert not hasattr(module, "a")
@@ -0,0 +1,63 @@
+# -*- coding:utf-8 -*-
+import json
+
+from pytest_apistellar.profiler import Profiler
+
+
+class TestProfiler(object):
+
+    def test_disabled(self):
+        profiler = Profiler()
+        with profiler.timer("load", "os.path"):
+            pass
+        assert not profiler.stats
+
+    def test_report(self, tmp_path):
+        profiler = Profiler()
+        profiler.enabled = True
+        profiler.scope = "module"
+        with profiler.timer("load", "os.path"):
+            pass
+        with profiler.timer("load", "os.path"):
+            pass
+        with profiler.timer("undo", scope="function"):
+            pass
+        assert profiler.stats[("load", "module", "os.path")][0] == 2
+        assert profiler.stats[("undo", "function", None)][0] == 1
+
+        lines = []
+        profiler.report(lines.append)
+        assert any("os.path" in line for line in lines)
+
+        filename = str(tmp_path.joinpath("profile.json"))
+        profiler.dump(filename)
+        with open(filename) as f:
+            assert len(json.load(f)) == 2
+
+    def test_evaluate(self, monkeypatch):
+        import os
+        from pytest_apistellar.profiler import profiler
+        from pytest_apistellar.utils import resolve, lazy_value
+
+        monkeypatch.setattr(profiler, "enabled", True)
+        monkeypatch.setattr(profiler, "stats", dict())
+        # ini中配置的值在应用时才求值，求值耗时单独统计
+        assert resolve(lazy_value("os.path.join")) is os.path.join
+        assert [key[2] for key in profiler.stats
+                if key[0] == "evaluate"] == ["os.path.join"]
+
+    def test_scoped(self):
+        profiler = Profiler()
+        profiler.enabled = True
+        try:
+            with profiler.scoped("module"):
+                with profiler.timer("load", "os.path"):
+                    raise ValueError()
+        except ValueError:
+            pass
+        # 出错后作用域也会恢复，不会影响之后的统计
+        assert profiler.scope is None
+        with profiler.timer("load", "os.path"):
+            pass
+        assert profiler.stats[("load", "module", "os.path")][0] == 1
+        assert profiler.stats[("load", None, "os.path")][0] == 1
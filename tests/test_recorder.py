@@ -0,0 +1,57 @@
+# -*- coding:utf-8 -*-
+import os
+import pytest
+import threading
+
+from pytest_apistellar.recorder import CallRecorder
+
+
+class TestCallRecorder(object):
+
+    def test_ring_buffer(self):
+        recorder = CallRecorder(3)
+        assert not recorder.called
+        for i in range(5):
+            recorder.append((i, ), {"i": i})
+        assert len(recorder.buffer) == 3
+        assert recorder.call_count == 5
+        assert [call.args for call in recorder] == [(2, ), (3, ), (4, )]
+        assert recorder.last_call.kwargs == {"i": 4}
+        recorder.clear()
+        assert recorder.call_count == 0
+
+    def test_threads(self):
+        recorder = CallRecorder(True)
+
+        def call():
+            for i in range(1000):
+                recorder.append((i, ), {})
+
+        threads = [threading.Thread(target=call) for _ in range(4)]
+        for th in threads:
+            th.start()
+        for th in threads:
+            th.join()
+        assert recorder.call_count == 4000
+        assert len(recorder) == CallRecorder.default_size
+
+    def test_invalid_size(self):
+        with pytest.raises(ValueError):
+            CallRecorder(0)
+
+
+class TestRecord(object):
+
+    @pytest.mark.prop("os.path.join", ret_val="a", record=2)
+    def test_record(self, mock_calls):
+        assert os.path.join("b", c=1) == "a"
+        os.path.join("d")
+        os.path.join("e")
+        recorder = mock_calls["os.path.join"]
+        assert recorder.call_count == 3
+        assert [call.args for call in recorder] == [("d", ), ("e", )]
+        assert recorder.last_call.thread == threading.current_thread().ident
+
+    @pytest.mark.prop("os.path.join", ret_val="a")
+    def test_not_record(self, mock_calls):
+        assert "os.path.join" not in mock_calls
@@ -0,0 +1,87 @@
+# -*- coding:utf-8 -*-
+import os
+import pytest
+import threading
+
+from pytest_apistellar import utils
+
+
+class FakeServer(object):
+
+    def __init__(self, path):
+        self.config = path
+        self.should_exit = False
+        self.startup_time = 0.1
+        self.exited = threading.Event()
+
+    def run(self):
+        while not self.should_exit:
+            self.exited.wait(0.01)
+
+
+def create_server(path, uds=None):
+    server = FakeServer(path)
+    server.uds = uds
+    th = threading.Thread(target=server.run)
+    th.start()
+    return th, server
+
+
+class TestCreateServer(object):
+
+    def test_timeout(self, monkeypatch):
+        servers = list()
+        socks = list()
+
+        def run_server(path, container, ready, sock=None):
+            # 创建了server，但一直没有开始监听
+            server = FakeServer(path)
+            servers.append(server)
+            socks.append(sock)
+            container.append(server)
+            server.run()
+
+        monkeypatch.setattr(utils, "run_server", run_server)
+        with pytest.raises(RuntimeError):
+            utils.create_server("a", timeout=0.1)
+        assert servers[0].should_exit
+        assert socks[0].fileno() == -1
+
+
+class TestServerPool(object):
+
+    def test_reuse_by_path(self, monkeypatch):
+        monkeypatch.setattr(utils, "create_server", create_server)
+        pool = utils.ServerPool()
+        server = pool.get("a")
+        assert pool.get("a") is server
+        assert pool.get("b") is not server
+        pool.close()
+        assert server.should_exit
+        assert not pool.servers
+        assert [t[0] for t in pool.timings] == ["a", "b"]
+        assert all(t[2] < 1 for t in pool.timings)
+
+    def test_uds(self, monkeypatch):
+        monkeypatch.setattr(utils, "create_server", create_server)
+        pool = utils.ServerPool(uds=True)
+        server = pool.get("a")
+        assert server.uds.startswith(pool.tmp_dir)
+        assert pool.get("b").uds != server.uds
+        tmp_dir = pool.tmp_dir
+        pool.close()
+        assert not os.path.exists(tmp_dir)
+
+    def test_workers(self, monkeypatch):
+        stopped = list()
+        monkeypatch.setattr(
+            utils, "create_process_server",
+            lambda path, workers, uds=None: utils.ProcessServer(
+                (path, workers), list()))
+        monkeypatch.setattr(utils, "stop_process_server", stopped.append)
+        pool = utils.ServerPool(workers=2)
+        server = pool.get("a")
+        assert server.config == ("a", 2)
+        assert pool.get("a") is server
+        pool.close()
+        assert stopped == [server]
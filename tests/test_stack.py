@@ -0,0 +1,99 @@
+# -*- coding:utf-8 -*-
+import os
+import pytest
+
+from pytest_apistellar.patcher import MockStack, PropPatcher
+
+
+class TestMockStack(object):
+
+    def test_keep_shared_prefix(self, make_request):
+        stack = MockStack()
+        a = pytest.mark.env(STACK_A="1").mark
+        b = pytest.mark.env(STACK_B="2").mark
+        stack.apply(make_request("function", a, b))
+        patchers = [p for m, p in stack.entries]
+        assert os.environ["STACK_A"] == "1"
+        assert os.environ["STACK_B"] == "2"
+
+        stack.apply(make_request("function", a, b))
+        assert [p for m, p in stack.entries] == patchers
+
+        stack.apply(make_request("function", a))
+        assert [p for m, p in stack.entries] == patchers[:1]
+        assert os.environ["STACK_A"] == "1"
+        assert "STACK_B" not in os.environ
+
+        stack.undo()
+        assert not stack.entries
+        assert "STACK_A" not in os.environ
+
+    def test_keep_equal_marks(self, make_request):
+        stack = MockStack()
+        stack.apply(make_request("function", pytest.mark.env(STACK_C="3").mark))
+        patchers = [p for m, p in stack.entries]
+        # 不同单元测试上相同的mark不是同一个对象
+        stack.apply(make_request("function", pytest.mark.env(STACK_C="3").mark))
+        assert [p for m, p in stack.entries] == patchers
+        stack.apply(make_request("function", pytest.mark.env(STACK_C="4").mark))
+        assert [p for m, p in stack.entries] != patchers
+        assert os.environ["STACK_C"] == "4"
+        stack.undo()
+        assert "STACK_C" not in os.environ
+
+    def test_fresh(self, make_request):
+        stack = MockStack()
+        counter = []
+        mark = pytest.mark.prop(
+            "os.stack_fresh", ret_factory=lambda: counter.append(1) or len(counter),
+            callable=False, fresh=True).mark
+        stack.apply(make_request("function", mark))
+        assert os.stack_fresh == 1
+        stack.apply(make_request("function", mark))
+        assert os.stack_fresh == 2
+        stack.undo()
+        assert not hasattr(os, "stack_fresh")
+
+    def test_fresh_function_cache(self):
+        # 保留的替身持有上一个单元测试的缓存
+        assert MockStack.fresh(PropPatcher, pytest.mark.prop(
+            "os.stack_fresh", ret_factory=list, cache="function").mark)
+        assert not MockStack.fresh(PropPatcher, pytest.mark.prop(
+            "os.stack_fresh", ret_factory=list, cache="module").mark)
+
+    def test_skipped_neighbour(self, pytester, pytestconfig, monkeypatch):
+        pytester.makeini("[pytest]\nmock_diff = true\nusefixtures =\n    mock\n")
+        pytester.makepyfile(stack_target="value = 'orig'\n")
+        pytester.makepyfile(test_skip="""
+            import pytest
+            import stack_target
+
+
+            @pytest.mark.prop("stack_target.value", ret_val="class")
+            class TestSkip(object):
+
+                @pytest.mark.prop("stack_target.value", ret_val="function")
+                def test_one(self):
+                    assert stack_target.value == "function"
+
+                @pytest.mark.skip
+                def test_skip(self):
+                    pass
+
+                @pytest.mark.xfail(run=False)
+                def test_xfail(self):
+                    pass
+
+
+            def test_after():
+                assert stack_target.value == "orig"
+            """)
+        monkeypatch.setenv("PYTHONPATH", os.pathsep.join([
+            os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+            str(pytester.path)]))
+        # 通过-p加载插件时子进程中也需要指定
+        args = list() if pytestconfig.pluginmanager.has_plugin(
+            "apistellar") else ["-p", "pytest_apistellar.plugins"]
+        # 被跳过的单元测试不执行mock fixture，mock需要在class结束时撤销
+        result = pytester.runpytest_subprocess(*args)
+        result.assert_outcomes(passed=2, skipped=1, xfailed=1)